@@ -5,6 +5,9 @@
 # @function: 用于计算每轮预测准确率时，前向网络权值装载和预测分割结果的生成
 
 
+import os
+import time
+import hashlib
 import torch
 import torch.nn            as nn
 import torch.nn.functional as F
@@ -26,20 +29,103 @@ from nets.UperNet             import UperNet
 from nets.segnext             import SegNeXt
 from nets.hrnet_ocr           import hrnetocr
 from nets.mask2former         import Mask2Former
+from utils.tiling             import axis_spans, tile_grid, empty_tile, accumulate, TileBatcher
+from utils.cpu_pool           import predict_tiles_in_pool, merge_stats
+from utils.precision          import PRECISIONS, keep_sensitive_float32, cast_model, autocast_context
+from utils.quantization       import DYNAMIC_QUANT_TYPES, dynamic_quantize, quantized_cache_path, load_cached_quantized, save_cached_quantized
+from utils.ort_backend        import onnx_path_for, create_session
+from utils.compiled           import CompiledForward
+from utils.autotune           import autotune
+from utils.tile_cache         import TileCache
+from utils.run_report         import RunReport
+from utils.input_stage        import to_model_input
+
+
+PALETTE = {
+    0: [0,   0,  0],       # background
+    1: [0,  255, 0],       # class 1
+    2: [255, 0,  0],       # class 2
+}
+
+# Test-time augmentation views as (horizontal flip, number of 90° rotations). The first four keep the
+# tile shape, the rotated ones are only used on square tiles.
+TTA_TRANSFORMS = [(False, 0), (True, 0), (False, 2), (True, 2), (False, 1), (False, 3), (True, 1), (True, 3)]
+
+# Output value of pixels that are only covered by skipped (empty) tiles
+NODATA_CLASS = 255
+
 
 class Model:
-    def __init__(self, model_path, bands, num_class, model_type='unet', backbone='vggnet', atten_type='senet', img_size=256):
-        self.model_path = model_path
-        self.bands      = bands
-        self.num_class  = num_class
-        self.model_type = model_type
-        self.backbone   = backbone
-        self.img_size   = img_size
-        self.atten_type = atten_type
-        self.cuda       = torch.cuda.is_available()
+    def __init__(self, model_path, bands, num_class, model_type='unet', backbone='vggnet', atten_type='senet', img_size=256, batch_size=8, skip_empty=False, workers=0, worker_threads=None, tta=1, tta_budget=None, precision='fp32', autocast=True, quantize=None, backend='torch', ort_threads=0, compile_mode=None, compile_cache='./compile_cache', tile_memory_mb=2048, autotune_cache='./autotune_cache.json', screen=None, screen_threshold=0.9, tile_cache=None, tile_cache_mb=2048, progress=None, input_scale=None):
+        self.model_path     = model_path
+        self.bands          = bands
+        self.num_class      = num_class
+        self.model_type     = model_type
+        self.backbone       = backbone
+        self.img_size       = img_size
+        self.atten_type     = atten_type
+        self.batch_size     = batch_size
+        self.skip_empty     = skip_empty
+        self.workers        = workers
+        self.worker_threads = worker_threads
+        self.tta            = min(max(tta, 1), len(TTA_TRANSFORMS))
+        self.tta_views      = self.tta
+        self.tta_budget     = tta_budget
+        self.precision      = precision
+        self.autocast       = autocast
+        self.quantize       = quantize
+        self.backend        = backend
+        self.ort_threads    = ort_threads
+        self.session        = None
+        self.compile_mode   = compile_mode
+        self.compile_cache  = compile_cache
+        self._compiled      = None
+        self._pad_batch     = None
+        self.tile_memory_mb = tile_memory_mb
+        self.autotune_cache = autotune_cache
+        self._tuned         = None
+        self.screen         = screen
+        self.screen_thresh  = screen_threshold
+        self.tile_cache     = TileCache(tile_cache, tile_cache_mb) if tile_cache else None
+        self._cache_id      = None
+        self.progress       = progress
+        self.report         = RunReport(progress)
+        self.input_scale    = input_scale
+        self.run_stats      = {}
+        self._clock         = {}
+        self.cuda           = torch.cuda.is_available()
+        self._batchers      = {}
         self.generate()
 
     def generate(self):
+        # ONNX Runtime runs the graph written by export_onnx.py next to the .pth, tiles stay on the host
+        if self.backend == 'onnxruntime':
+            self.session = create_session(onnx_path_for(self.model_path), threads=self.ort_threads, use_cuda=self.cuda)
+            self.cuda    = False
+            self.model   = None
+            return
+        if self.backend != 'torch':
+            raise NotImplementedError('backend [%s] is not implemented, torch/onnxruntime is supported!' %self.backend)
+
+        # int8 models run on CPU and are loaded from the cache next to the .pth when it is up to date
+        if self.quantize:
+            if self.quantize not in ('dynamic', 'static'):
+                raise NotImplementedError('quantize type [%s] is not implemented, dynamic/static is supported!' %self.quantize)
+            if self.precision != 'fp32':
+                raise ValueError("int8 quantization can not be combined with reduced precision, use precision='fp32'.")
+            if self.quantize == 'static' and self.compile_mode:
+                raise ValueError("the static int8 model is already a frozen TorchScript graph, use compile_mode=None with quantize='static'.")
+            if self.quantize == 'dynamic' and self.model_type not in DYNAMIC_QUANT_TYPES:
+                print(f"Warning: dynamic int8 only quantizes nn.Linear layers, {self.model_type} is convolution bound "
+                      f"(dynamic quantization targets {'/'.join(DYNAMIC_QUANT_TYPES)}, try quantize='static').")
+            self.cuda  = False
+            self.model = load_cached_quantized(self.model_path, self.quantize)
+            if self.model is not None:
+                self._prepare()
+                return
+            if self.quantize == 'static':
+                raise FileNotFoundError(f"No calibrated static int8 model for {self.model_path}, run quantize.py first.")
+
         if self.model_type == 'unet':
             self.model = Unet(bands=self.bands, num_classes=self.num_class, backbone=self.backbone, atten_type=self.atten_type)
         elif self.model_type == 'deeplab':
@@ -80,86 +166,455 @@ class Model:
             print(f"Error loading model weights: {e}")
             raise e
 
+        if self.quantize == 'dynamic':
+            self.model = dynamic_quantize(self.model)
+            save_cached_quantized(self.model, self.model_path, self.quantize)
+        self._prepare()
+
+
+    # Precision, device and compilation of the loaded (or cached int8) network
+    def _prepare(self):
+        # bf16/fp16: autocast the forward pass, or cast the weights when autocast is off.
+        # Softmax and normalization layers stay in float32 in both cases.
+        if self.precision not in PRECISIONS:
+            raise NotImplementedError('precision [%s] is not implemented, fp32/bf16/fp16 is supported!' %self.precision)
+        if self.precision != 'fp32':
+            keep_sensitive_float32(self.model)
+            if not self.autocast:
+                cast_model(self.model, PRECISIONS[self.precision])
+
         if self.cuda:
             self.model = nn.DataParallel(self.model)
             self.model = self.model.cuda()
 
+        if self.compile_mode:
+            self._compile()
 
-    def predict_small_patch(self, image):
-        """Predict single image patch(256×256)"""
 
-        assert image.ndim == 3, f"input image dimension show be [C, H, W], but get {image.shape} instead."
-        c, h, w      = image.shape
-        image_tensor = torch.tensor(image, dtype=torch.float32).unsqueeze(0)
+    # Graphs are specialized per (tile shape, batch size), partial batches are padded to the run's batch size in _forward
+    def _compile(self):
+        net            = self.model.module if isinstance(self.model, nn.DataParallel) else self.model
+        graph_hash     = hashlib.blake2b(self._graph_id().encode(), digest_size=6).hexdigest()
+        tag            = f"{self.model_type}-{os.path.splitext(os.path.basename(self.model_path))[0]}-{graph_hash}"
+        self._compiled = CompiledForward(net, self.compile_mode, self.compile_cache, tag, self.model_path)
+
+
+    # Staging buffers, compiled graphs and the job report are not pickled for pool workers. _init_worker rebuilds the
+    # compiled graphs from the on-disk compile cache and loads the frozen static int8 graph from its cache file
+    def __getstate__(self):
+        state              = self.__dict__.copy()
+        state['_batchers'] = {}
+        state['_compiled'] = None
+        state['progress']  = None
+        state['report']    = RunReport()
+        if self.quantize == 'static':
+            state['model'] = None
+        return state
+
+
+    # Called by every pool worker (utils.cpu_pool) before its first tile, run_stats then only count the worker's tiles
+    def _init_worker(self):
+        self.run_stats = {}
+        if self.model is None:
+            self.model = torch.jit.load(quantized_cache_path(self.model_path, 'static'), map_location='cpu').eval()
+        if self.compile_mode:
+            self._compile()
+        if self.screen is not None:
+            self.screen._init_worker()
+
+
+    # Fresh per-job report, `meta` (image path, settings...) is written into the JSON as is
+    def new_report(self, **meta):
+        self.report = RunReport(self.progress, model_type=self.model_type, backbone=self.backbone, model_path=self.model_path, **meta)
+        return self.report
+
+
+    # Float32 logits of a batch that is already on the model device. Compiled graphs get partial batches padded to
+    # `pad_to`, by default the batch size of the current run (batch_size outside of predict_large_*)
+    def _forward(self, batch, pad_to=None):
+        if self.session is not None:
+            feed = {self.session.get_inputs()[0].name: batch.numpy()}
+            return torch.from_numpy(self.session.run(None, feed)[0]).float()
+        if self.precision != 'fp32' and not self.autocast:
+            batch = batch.to(PRECISIONS[self.precision])
+        n      = batch.shape[0]
+        pad_to = pad_to or self._pad_batch or self.batch_size
+        if self._compiled is not None and n < pad_to:
+            batch = torch.cat([batch, batch.new_zeros((pad_to - n,) + tuple(batch.shape[1:]))])
+        with autocast_context(batch.device.type, self.precision, self.autocast):
+            return (self._compiled or self.model)(batch)[:n].float()
+
+
+    def predict_batch(self, batch):
+        """Predict a batch of tiles [N, C, H, W] (cpu tensor of any dtype), return class map [N, H, W]"""
+
+        with self.report.stage('forward', items=batch.shape[0]), torch.no_grad():
+            if self.cuda:
+                batch = batch.cuda(non_blocking=True)
+            batch = to_model_input(batch, self.input_scale)
+            if self.screen is not None:
+                pr = self._predict_cascade(batch)
+            else:
+                pr = self._predict_views(batch)
+            pr = pr.cpu().numpy()
+        return pr
 
+
+    def _predict_views(self, batch):
+        if self.tta_views > 1:
+            return self._predict_tta(batch, self.tta_views)
+        pr = self._forward(batch)                 # [N, num_classes, H, W]
+        return pr.argmax(dim=1)                   # [N, H, W], softmax does not change the argmax
+
+
+    def _sync(self):
         if self.cuda:
-            image_tensor = image_tensor.cuda()
+            torch.cuda.synchronize()
+
+
+    # Cascade: the screening model predicts every tile, tiles with mixed classes or a mean confidence
+    # below screen_thresh are predicted again by this model and replace the screening result
+    def _predict_cascade(self, batch):
+        stats = self.run_stats
+        start = time.perf_counter()
+        probs = F.softmax(self.screen._forward(batch.to('cuda' if self.screen.cuda else 'cpu')), dim=1)
+        conf, pr = probs.max(dim=1)
+        pr       = pr.to(batch.device)
+        flat     = pr.flatten(1)
+        escalate = ((flat != flat[:, :1]).any(dim=1) | (conf.flatten(1).mean(dim=1) < self.screen_thresh)).to(batch.device)
+        self._sync()
+        middle   = time.perf_counter()
+
+        if escalate.any():
+            pr[escalate] = self._predict_views(batch[escalate])
+            self._sync()
 
-        with torch.no_grad():
-            pr = self.model(image_tensor)         # [1, num_classes, H, W]
-            pr = F.softmax(pr, dim=1)             # [1, num_classes, H, W]
-            pr = pr.argmax(dim=1)                 # [1, H, W]
-            pr = pr.squeeze(0).cpu().numpy()      # [H, W]
+        stats['screened']  = stats.get('screened', 0) + len(pr)
+        stats['escalated'] = stats.get('escalated', 0) + int(escalate.sum())
+        stats['screen_s']  = stats.get('screen_s', 0.0) + middle - start
+        stats['heavy_s']   = stats.get('heavy_s', 0.0) + time.perf_counter() - middle
         return pr
 
 
-    def predict_large_image(self, image, tile_size=256, overlap=64):
-        """Predict large image"""
+    # All augmented views go through one forward pass, probabilities are mapped back and averaged before argmax
+    def _predict_tta(self, batch, views):
+        h, w       = batch.shape[-2:]
+        transforms = [t for t in TTA_TRANSFORMS if h == w or t[1] % 2 == 0][:views]
+        stacked    = torch.cat([torch.rot90(batch.flip(-1) if flip else batch, k, (-2, -1)) for flip, k in transforms])
+        probs      = F.softmax(self._forward(stacked), dim=1).chunk(len(transforms))
+
+        mean = 0
+        for (flip, k), prob in zip(transforms, probs):
+            prob = torch.rot90(prob, -k, (-2, -1))
+            mean = mean + (prob.flip(-1) if flip else prob)
+        return mean.argmax(dim=1)
+
+
+    # Reset per-run statistics, `total` is the number of tiles of the scene, `batch_size` the one of the tile batcher
+    def _start_run(self, total, batch_size):
+        self.run_stats  = {'tiles': 0, 'skipped': 0}
+        self._pad_batch = batch_size
+        if self.screen is not None:
+            self.screen._pad_batch = batch_size
+        self.tta_views  = self.tta
+        self._clock     = {'start': time.perf_counter(), 'total': total, 'done': 0, 'view_tiles': 0}
+        if self.tile_cache is not None:
+            self.tile_cache.start_job()
+
+
+    # Shrink the number of TTA views so that the remaining tiles still fit in tta_budget seconds
+    def _adapt_tta(self):
+        clock     = self._clock
+        elapsed   = time.perf_counter() - clock['start']
+        per_view  = elapsed / max(clock['view_tiles'], 1)
+        remaining = max(clock['total'] - clock['done'], 0)
+        if remaining:
+            views          = int((self.tta_budget - elapsed) / (remaining * per_view))
+            self.tta_views = min(max(views, 1), self.tta)
+
+
+    # `count` more tiles predicted with `views` forward views each, reported to the progress callback.
+    # Returns the number of TTA views for the next tiles, adapted to tta_budget if it is set
+    def _tiles_done(self, count, views):
+        self._clock['done']       += count
+        self._clock['view_tiles'] += count * views
+        self.report.progress(self._clock['done'], self._clock['total'])
+        if self.tta > 1 and self.tta_budget:
+            self._adapt_tta()
+        return self.tta_views
+
+
+    def _predict_batches(self, batcher, tiles):
+        """Yield (predictions, slots) batch by batch, adapting the TTA views to tta_budget if it is set"""
+
+        for predictions, slots, views in self._batch_predictions(batcher, tiles):
+            yield predictions, slots
+            self._tiles_done(len(slots), views)
+        self.run_stats['tta_views'] = self.tta_views
+
+
+    # (predictions, slots, forward views per tile), tiles found in the tile cache come alone and cost no view
+    def _batch_predictions(self, batcher, tiles):
+        if self.tile_cache is None:
+            for batch, slots in self.report.timed_iter('batching', batcher.batches(tiles)):
+                yield self.predict_batch(batch), slots, self.tta_views
+            return
+
+        pending = []
+        for patch, meta in tiles:
+            key        = self.tile_cache.key(f"{self._model_id()}|{self.tta_views}", patch, batcher.bucket_shape(*patch.shape[1:]))
+            prediction = self.tile_cache.get(key)
+            if prediction is not None:
+                yield prediction[np.newaxis], [(meta,) + patch.shape[1:]], 0
+                continue
+            pending.append((patch, (meta, key)))
+            if len(pending) == batcher.batch_size:
+                yield from self._predict_and_cache(batcher, pending)
+                pending = []
+        if pending:
+            yield from self._predict_and_cache(batcher, pending)
+
+
+    def _predict_and_cache(self, batcher, tiles):
+        for batch, slots in self.report.timed_iter('batching', batcher.batches(tiles)):
+            start       = time.perf_counter()
+            predictions = self.predict_batch(batch)
+            seconds     = (time.perf_counter() - start) / len(slots)
+            for prediction, ((_, key), th, tw) in zip(predictions, slots):
+                self.tile_cache.put(key, prediction[:th, :tw], seconds)
+            yield predictions, [(meta, th, tw) for (meta, _), th, tw in slots], self.tta_views
+
+
+    # Checkpoint content and every setting that changes the network graph (compiled graph cache key)
+    def _graph_id(self):
+        parts = [TileCache.file_digest(self.model_path), self.model_type, self.backbone, self.atten_type, self.bands,
+                 self.num_class, self.precision, self.autocast, self.quantize, self.backend]
+        return '|'.join(str(part) for part in parts)
+
+
+    # Everything besides the tile that changes a prediction: the graph, input scaling and the cascade
+    def _model_id(self):
+        if self._cache_id is None:
+            parts = [self._graph_id(), self.input_scale]
+            if self.screen is not None:
+                parts += [TileCache.file_digest(self.screen.model_path), self.screen.model_type, self.screen_thresh]
+            self._cache_id = '|'.join(str(part) for part in parts)
+        return self._cache_id
+
+
+    # Staging buffers are kept across calls, one batcher per (bands, tile_size, batch_size)
+    def _batcher(self, bands, tile_size, batch_size):
+        key = (bands, tile_size, batch_size)
+        if key not in self._batchers:
+            self._batchers[key] = TileBatcher(bands, tile_size=tile_size, batch_size=batch_size, pin_memory=self.cuda)
+        return self._batchers[key]
+
+
+    # Drop empty / constant tiles before they reach a batch when skip_empty is set, counting them in run_stats
+    def _valid_tiles(self, tiles, nodata=None):
+        for patch, meta in tiles:
+            self.run_stats['tiles'] += 1
+            if self.skip_empty and empty_tile(patch, nodata):
+                self.run_stats['skipped'] += 1
+                self._clock['done']       += 1
+                continue
+            yield patch, meta
+
+
+    # Average the stitched class votes, pixels without any predicted tile become NODATA_CLASS
+    @staticmethod
+    def _finish(outputs, weights):
+        result = np.round(outputs / (weights + 1e-6)).astype(np.uint8)
+        result[weights == 0] = NODATA_CLASS
+        return result
+
+
+    def _report_skipped(self):
+        if self.skip_empty:
+            print(f"Skipped {self.run_stats['skipped']}/{self.run_stats['tiles']} empty tiles without forward pass.")
+
+
+    # Console summaries, the run statistics go into the job report
+    def _end_run(self):
+        self._pad_batch = None
+        if self.screen is not None:
+            self.screen._pad_batch = None
+        self._report_skipped()
+        self._report_cascade()
+        self._report_cache()
+        self.report.stats.update(self.run_stats)
+        self.report.stats['staging_mb'] = sum(batcher.nbytes for batcher in self._batchers.values()) / 1024**2
+        if self.tile_cache is not None:
+            self.report.stats.update({f'cache_{k}': v for k, v in self.tile_cache.stats.items()})
+
+
+    def _report_cache(self):
+        if self.tile_cache is not None:
+            self.tile_cache.report()
+
+
+    # Escalated fraction and speedup against running every screened tile through this model
+    def _report_cascade(self):
+        stats = self.run_stats
+        if self.screen is None or not stats.get('screened'):
+            return
+        print(f"Cascade: {stats['escalated']}/{stats['screened']} tiles escalated ({stats['escalated']/stats['screened']:.1%}).")
+        if stats['escalated']:
+            heavy_only = stats['heavy_s'] / stats['escalated'] * stats['screened']
+            print(f"Cascade: {stats['screen_s']+stats['heavy_s']:.2f}s vs. {heavy_only:.2f}s estimated without screening "
+                  f"({heavy_only/(stats['screen_s']+stats['heavy_s']):.2f}x).")
+
+
+    # tile_size='auto': tile and batch size of the fastest configuration within tile_memory_mb, tuned once per (model, machine)
+    def _tile_config(self, tile_size, batch_size, overlap):
+        if tile_size != 'auto':
+            return tile_size, batch_size or self.batch_size
+        if self._tuned is None:
+            self._tuned = autotune(self, self.tile_memory_mb, overlap, self.autotune_cache)
+        return self._tuned['tile_size'], batch_size or self._tuned['batch_size']
+
+
+    def predict_small_patch(self, image):
+        """Predict single image patch(256×256)"""
+
+        assert image.ndim == 3, f"input image dimension show be [C, H, W], but get {image.shape} instead."
+        image_tensor = torch.from_numpy(np.ascontiguousarray(image)).unsqueeze(0)
+        return self.predict_batch(image_tensor)[0]
+
+
+    def predict_large_image(self, image, tile_size=256, overlap=64, batch_size=None, nodata=None):
+        """
+        Predict large image, tiles are packed into batches of `batch_size` for every forward pass.
+        With skip_empty, tiles that are all NaN / `nodata` or constant are not predicted and left as NODATA_CLASS.
+        tile_size='auto' picks tile and batch size with utils.autotune.
+        """
 
         assert image.ndim == 3, f"input image dimension show be [C, H, W], but get {image.shape} instead."
-        c, h, w         = image.shape
-        stride          = tile_size - overlap
-        outputs         = np.zeros((h, w), dtype=np.float64)
-        weights         = np.zeros((h, w), dtype=np.float32) 
-        patches, coords = [], []
-        for i in range(0, h, stride):
-            for j in range(0, w, stride):
-                x_end   = min(i     + tile_size, h)
-                y_end   = min(j     + tile_size, w)
-                x_start = max(x_end - tile_size, 0)
-                y_start = max(y_end - tile_size, 0)
-
-                patches.append(image[:, x_start:x_end, y_start:y_end])
-                coords.append((x_start, x_end, y_start, y_end))
-
-        for patch, (x_start, x_end, y_start, y_end) in zip(patches, coords):
-            prediction = self.predict_small_patch(patch)
-            outputs[x_start:x_end, y_start:y_end] += prediction
-            weights[x_start:x_end, y_start:y_end] += 1
-
-        outputs = outputs / (weights + 1e-6)
-        return np.round(outputs).astype(np.uint8)
-
-
-    def get_small_predict_png(self, image):
-        if image is None:
+        c, h, w               = image.shape
+        tile_size, batch_size = self._tile_config(tile_size, batch_size, overlap)
+        grid                  = tile_grid(h, w, tile_size, overlap)
+        self._start_run(len(grid), batch_size)
+
+        tiles = ((image[:, x_start:x_end, y_start:y_end], (x_start, x_end, y_start, y_end, repeat))
+                 for x_start, x_end, y_start, y_end, repeat in grid)
+        tiles = self._valid_tiles(tiles, nodata)
+
+        if self.workers > 1 and not self.cuda and self.session is None:
+            # Tiles are handed to a pool of core-pinned worker processes sharing model weights and accumulator
+            grid             = [meta for _, meta in tiles]
+            with self.report.stage('forward', items=len(grid)):
+                outputs, weights, stats = predict_tiles_in_pool(self, image, grid, tile_size, batch_size, self.workers,
+                                                                self.worker_threads, on_chunk=self._tiles_done)
+            self.run_stats = merge_stats([self.run_stats, stats])
+            self.run_stats['tta_views'] = self.tta_views
+        else:
+            outputs = np.zeros((h, w), dtype=np.float64)
+            weights = np.zeros((h, w), dtype=np.float32)
+            batcher = self._batcher(c, tile_size, batch_size)
+            for predictions, slots in self._predict_batches(batcher, tiles):
+                with self.report.stage('stitch'):
+                    accumulate(outputs, weights, predictions, slots)
+
+        with self.report.stage('stitch'):
+            result = self._finish(outputs, weights)
+        self._end_run()
+        return result
+
+
+    def predict_large_raster(self, read_window, write_rows, bands, height, width, tile_size=256, overlap=64, batch_size=None, memory_mb=1024, itemsize=4, nodata=None):
+        """
+        Streaming prediction of a raster larger than RAM, gives the same result as predict_large_image.
+        read_window(xoff, yoff, xsize, ysize) -> [C, ysize, xsize] array of the source raster
+        write_rows(rows, yoff)                 -> receives finished uint8 rows [n, width] from top to bottom
+        Only one strip of `tile_size` rows of the accumulator is resident, input windows are sized so that
+        accumulator + staging buffers + one read window stay under `memory_mb`.
+        """
+
+        tile_size, batch_size = self._tile_config(tile_size, batch_size, overlap)
+        strip_h    = min(tile_size, height)
+        acc_bytes  = strip_h * width * (8 + 4)
+        stage_byte = batch_size * bands * tile_size * tile_size * itemsize
+        read_bytes = memory_mb * 1024**2 - acc_bytes - stage_byte
+        col_bytes  = bands * strip_h * itemsize
+        min_mb     = (acc_bytes + stage_byte + col_bytes * min(tile_size, width)) / 1024**2
+        if read_bytes < col_bytes * min(tile_size, width):
+            raise ValueError(f"memory budget {memory_mb}MB is too small, at least {min_mb:.0f}MB is needed for width {width}.")
+        chunk_w    = read_bytes // col_bytes
+
+        # Consecutive tile columns whose union fits in one read window
+        col_groups = [[]]
+        for span in axis_spans(width, tile_size, overlap):
+            if col_groups[-1] and span[1] - col_groups[-1][0][0] > chunk_w:
+                col_groups.append([])
+            col_groups[-1].append(span)
+
+        row_spans  = axis_spans(height, tile_size, overlap)
+        outputs    = np.zeros((strip_h, width), dtype=np.float64)
+        weights    = np.zeros((strip_h, width), dtype=np.float32)
+        batcher    = self._batcher(bands, tile_size, batch_size)
+        self._start_run(len(row_spans) * sum(len(group) for group in col_groups), batch_size)
+
+        for k, (x_start, x_end, x_rep) in enumerate(row_spans):
+            # rows above x_start are already flushed, strip row 0 is image row x_start
+            for group in col_groups:
+                g_start = group[0][0]
+                start   = time.perf_counter()
+                window  = read_window(g_start, x_start, group[-1][1] - g_start, x_end - x_start)
+                self.report.add('read', time.perf_counter() - start, bytes_read=window.nbytes)
+                if window.ndim == 2:
+                    window = window[np.newaxis]
+                tiles   = ((window[:, :, y_start-g_start:y_end-g_start], (y_start, y_end, x_rep * y_rep))
+                           for y_start, y_end, y_rep in group)
+                tiles   = self._valid_tiles(tiles, nodata)
+
+                for predictions, slots in self._predict_batches(batcher, tiles):
+                    with self.report.stage('stitch'):
+                        for prediction, ((y_start, y_end, repeat), th, tw) in zip(predictions, slots):
+                            prediction = prediction[:th, :tw]
+                            outputs[:th, y_start:y_end] += prediction * repeat if repeat > 1 else prediction
+                            weights[:th, y_start:y_end] += repeat
+
+            next_start = row_spans[k+1][0] if k + 1 < len(row_spans) else height
+            done       = next_start - x_start
+            if done > 0:
+                with self.report.stage('stitch'):
+                    rows = self._finish(outputs[:done], weights[:done])
+                with self.report.stage('write', bytes_written=rows.nbytes):
+                    write_rows(rows, x_start)
+                outputs[:strip_h-done] = outputs[done:]
+                weights[:strip_h-done] = weights[done:]
+                outputs[strip_h-done:] = 0
+                weights[strip_h-done:] = 0
+
+        self._end_run()
+
+
+    # Palette lookup table, one vectorized gather instead of a mask per class
+    @staticmethod
+    def colorize(mask):
+        lut = np.zeros((256, 3), dtype=np.uint8)
+        for cls_id, color in PALETTE.items():
+            lut[cls_id] = color
+        return lut[mask]
+
+
+    def mask_to_png(self, mask):
+        return Image.fromarray(self.colorize(mask))
+
+
+    def get_small_predict_png(self, image, mask=None):
+        if image is None and mask is None:
             raise ValueError("Image read error, please check path or format of file.")
-        
-        mask = self.predict_small_patch(image)
-        palette = {
-            0: [0,   0,  0],       # background
-            1: [0,  255, 0],       # class 1
-            2: [255, 0,  0],       # class 2
-        }
-        h, w = mask.shape
-        rgb  = np.zeros((h, w, 3), dtype=np.uint8)
-        for cls_id, color in palette.items():
-            rgb[mask == cls_id] = color
-        return Image.fromarray(rgb)
-
-
-    def get_large_predict_png(self, image):
-        if image is None:
+
+        if mask is None:
+            mask = self.predict_small_patch(image)
+        return self.mask_to_png(mask)
+
+
+    def get_large_predict_png(self, image, mask=None):
+        if image is None and mask is None:
             raise ValueError("Image read error, please check path or format of file.")
-        
-        mask = self.predict_large_image(image)
-        palette = {
-            0: [0,   0,  0],       # background
-            1: [0,  255, 0],       # class 1
-            2: [255, 0,  0],       # class 2
-        }
-        h, w = mask.shape
-        rgb  = np.zeros((h, w, 3), dtype=np.uint8)
-        for cls_id, color in palette.items():
-            rgb[mask == cls_id] = color
-        return Image.fromarray(rgb)
+
+        if mask is None:
+            mask = self.predict_large_image(image)
+        return self.mask_to_png(mask)
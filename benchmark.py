@@ -0,0 +1,246 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/7/22} ${17:15}
+# @Function   : inference benchmarks
+# @Description: python benchmark.py --MODE cpu_pool --MODEL_TYPE unet --BACKBONE_TYPE vgg11 --MODEL_PATH ./pth_files/xxx.pth
+
+
+import os
+import time
+import argparse
+import torch
+import numpy as np
+
+from Structure         import Model
+from utils.metrics     import Evaluator
+from utils.input_stage import to_model_input
+
+
+parser = argparse.ArgumentParser(description="Inference benchmarks of Structure.Model")
+parser.add_argument('--MODE',           type=str,   default='cpu_pool', choices=['cpu_pool', 'precision', 'quantize', 'onnx', 'compile', 'cog', 'dataset', 'dtype'])
+parser.add_argument('--MODEL_PATH',     type=str,   default=None)
+parser.add_argument('--MODEL_TYPE',     type=str,   default='unet')
+parser.add_argument('--BACKBONE_TYPE',  type=str,   default='vgg11')
+parser.add_argument('--ATTENTION_TYPE', type=str,   default=None)
+parser.add_argument('--BANDS',          type=int,   default=10)
+parser.add_argument('--NUM_CLASS',      type=int,   default=3)
+parser.add_argument('--IMAGE_SIZE',     type=int,   default=2048)
+parser.add_argument('--BATCH_SIZE',     type=int,   default=8)
+parser.add_argument('--DATASET_PATH',   type=str,   default='./datasets/')
+parser.add_argument('--TILE_SIZE',      type=int,   default=256)
+parser.add_argument('--ROUNDS',         type=int,   default=10)
+parser.add_argument('--COMPILE',        type=str,   default='torchscript', choices=['torchscript','inductor'])
+parser.add_argument('--QUANTIZE',       type=str,   default='dynamic',  choices=['dynamic','static'])
+parser.add_argument('--RASTER_PATH',    type=str,   default='./output/seg_test1_data_class.tif')
+parser.add_argument('--SHARD_PATH',     type=str,   default='./datasets/shards/')
+parser.add_argument('--NUM_WORKERS',    type=int,   default=0)
+
+
+def build_model(args, **kwargs):
+    return Model(model_path=args.MODEL_PATH, bands=args.BANDS, num_class=args.NUM_CLASS, model_type=args.MODEL_TYPE,
+                 backbone=args.BACKBONE_TYPE, atten_type=args.ATTENTION_TYPE, batch_size=args.BATCH_SIZE, **kwargs)
+
+
+def timed(fn, *args, **kwargs):
+    start  = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# mIoU and throughput of a model on annotations/val.txt
+def evaluate(model, args):
+    from torch.utils.data import DataLoader
+    from utils.dataset    import Labeled_Model_Dataset
+
+    with open(os.path.join(args.DATASET_PATH, "annotations/val.txt"), "r") as f:
+        val_lines = f.readlines()
+    loader    = DataLoader(Labeled_Model_Dataset(val_lines, args.DATASET_PATH), batch_size=args.BATCH_SIZE, shuffle=False)
+    evaluator = Evaluator(args.NUM_CLASS)
+
+    seconds, tiles = 0.0, 0
+    for image, label in loader:
+        pred, elapsed = timed(model.predict_batch, to_model_input(image, nan=0.0))
+        seconds      += elapsed
+        tiles        += image.shape[0]
+        evaluator.add_batch(label.numpy(), pred)
+    mIoU, _ = evaluator.mean_Intersection_over_Union()
+    return mIoU, tiles / seconds
+
+
+# Throughput gain vs. mIoU cost of reduced precision inference against float32
+def bench_precision(args):
+    configs = [('fp32', True), ('bf16', True), ('fp16', True), ('bf16', False), ('fp16', False)]
+    print(f"{'precision':<12}{'mode':<10}{'mIoU':>8}{'delta':>9}{'tiles/s':>10}{'speedup':>9}")
+
+    base = None
+    for precision, autocast in configs:
+        try:
+            model = build_model(args, precision=precision, autocast=autocast)
+            mIoU, speed = evaluate(model, args)
+        except RuntimeError as e:
+            print(f"{precision:<12}{'autocast' if autocast else 'cast':<10} not supported: {e}")
+            continue
+        base = base or (mIoU, speed)
+        print(f"{precision:<12}{'autocast' if autocast else 'cast':<10}{mIoU:>8.4f}{mIoU-base[0]:>+9.4f}{speed:>10.1f}{speed/base[1]:>8.2f}x")
+
+
+# Latency and mIoU of the int8 model against float32, dynamic fills its cache on first run, static needs quantize.py first
+def bench_quantize(args):
+    print(f"{'model':<14}{'weights':<10}{'mIoU':>8}{'delta':>9}{'ms/tile':>10}{'speedup':>9}")
+
+    base = None
+    for quantize in (None, args.QUANTIZE):
+        model       = build_model(args, quantize=quantize)
+        mIoU, speed = evaluate(model, args)
+        base        = base or (mIoU, speed)
+        print(f"{args.MODEL_TYPE:<14}{quantize or 'fp32':<10}{mIoU:>8.4f}{mIoU-base[0]:>+9.4f}{1000/speed:>10.2f}{speed/base[1]:>8.2f}x")
+
+
+# Seconds per tile of model.predict_batch on random tiles, after one warmup batch
+def latency_per_tile(model, batch_size, args):
+    batch = torch.randn(batch_size, args.BANDS, args.TILE_SIZE, args.TILE_SIZE)
+    model.predict_batch(batch)
+    _, seconds = timed(lambda: [model.predict_batch(batch) for _ in range(args.ROUNDS)])
+    return seconds / (args.ROUNDS * batch_size)
+
+
+# Eager PyTorch against the ONNX Runtime session of export_onnx.py, per batch size
+def bench_onnx(args):
+    eager = build_model(args)
+    ort   = build_model(args, backend='onnxruntime')
+    tile  = torch.randn(2, args.BANDS, args.TILE_SIZE, args.TILE_SIZE)
+    agree = (eager.predict_batch(tile) == ort.predict_batch(tile)).mean()
+    print(f"pixel agreement eager/onnxruntime: {agree:.4f}")
+    print(f"{'batch':>6}{'eager ms/tile':>15}{'ort ms/tile':>13}{'speedup':>9}")
+
+    for batch_size in sorted({1, 4, args.BATCH_SIZE}):
+        eager_t = latency_per_tile(eager, batch_size, args)
+        ort_t   = latency_per_tile(ort, batch_size, args)
+        print(f"{batch_size:>6}{eager_t*1000:>15.2f}{ort_t*1000:>13.2f}{eager_t/ort_t:>8.2f}x")
+
+
+# Warmup (trace/compile or cache load + first batch) and steady-state latency, run twice to see the warm cache
+def bench_compile(args):
+    print(f"{'mode':<14}{'warmup s':>10}{'steady ms/tile':>16}")
+    batch = torch.randn(args.BATCH_SIZE, args.BANDS, args.TILE_SIZE, args.TILE_SIZE)
+
+    for compile_mode in (None, args.COMPILE, args.COMPILE):
+        model     = build_model(args, compile_mode=compile_mode)
+        _, warmup = timed(model.predict_batch, batch)
+        steady    = latency_per_tile(model, args.BATCH_SIZE, args)
+        print(f"{compile_mode or 'eager':<14}{warmup:>10.2f}{steady*1000:>16.2f}")
+
+
+# Size and write time of a class raster saved by the plain GTiff writer and by the COG writer
+def bench_cog(args):
+    import gdal
+    import tempfile
+    from predict_huge import save_prediction_as_geotiff, save_prediction_as_cog
+
+    dataset    = gdal.Open(args.RASTER_PATH)
+    prediction = dataset.ReadAsArray()
+    geo        = (dataset.GetGeoTransform(), dataset.GetProjection())
+    nodata     = dataset.GetRasterBand(1).GetNoDataValue()
+    dataset    = None
+
+    print(f"{'writer':<10}{'seconds':>10}{'MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, save in (('gtiff', save_prediction_as_geotiff), ('cog', save_prediction_as_cog)):
+            path       = os.path.join(tmp, f"{name}.tif")
+            _, seconds = timed(save, prediction, *geo, path, nodata=nodata)
+            print(f"{name:<10}{seconds:>10.2f}{os.path.getsize(path)/1024**2:>10.2f}")
+
+
+# Samples/s of loading annotations/val.txt from the GeoTIFFs and from the shards of build_shards.py, twice each (cold and warm page cache)
+def bench_dataset(args):
+    from torch.utils.data import DataLoader
+    from utils.dataset    import Labeled_Model_Dataset, Labeled_Shard_Dataset
+
+    with open(os.path.join(args.DATASET_PATH, "annotations/val.txt"), "r") as f:
+        val_lines = f.readlines()
+    datasets = (('geotiff', Labeled_Model_Dataset(val_lines, args.DATASET_PATH)), ('shards', Labeled_Shard_Dataset(args.SHARD_PATH, 'val')))
+
+    same = all(np.array_equal(a, b) for i in range(min(len(datasets[1][1]), 8)) for a, b in zip(datasets[0][1][i], datasets[1][1][i]))
+    print(f"first samples identical: {same}")
+    print(f"{'dataset':<10}{'pass':>6}{'seconds':>10}{'samples/s':>11}")
+
+    for name, dataset in datasets:
+        for run in (1, 2):
+            loader     = DataLoader(dataset, batch_size=args.BATCH_SIZE, shuffle=False, num_workers=args.NUM_WORKERS)
+            _, seconds = timed(lambda: [None for _ in loader])
+            print(f"{name:<10}{run:>6}{seconds:>10.2f}{len(dataset)/seconds:>11.1f}")
+
+
+# uint16 imagery kept in its dtype until the model device against float32 conversion at read time:
+# DataLoader transport (worker IPC, pinned copies) as in train.py, then Structure.Model on a whole scene
+def bench_dtype(args):
+    from torch.utils.data import DataLoader
+
+    rng     = np.random.default_rng(0)
+    samples = [rng.integers(0, 10000, (args.BANDS, args.TILE_SIZE, args.TILE_SIZE), dtype=np.uint16) for _ in range(args.BATCH_SIZE * 16)]
+    print(f"{'loader':<10}{'MB':>10}{'seconds':>10}{'samples/s':>11}")
+    for dtype in (np.float32, np.uint16):
+        data       = [sample.astype(dtype) for sample in samples]
+        loader     = DataLoader(data, batch_size=args.BATCH_SIZE, num_workers=args.NUM_WORKERS, pin_memory=torch.cuda.is_available())
+        _, seconds = timed(lambda: [to_model_input(batch.cuda(non_blocking=True) if torch.cuda.is_available() else batch) for batch in loader])
+        print(f"{np.dtype(dtype).name:<10}{sum(d.nbytes for d in data)/1024**2:>10.1f}{seconds:>10.2f}{len(data)/seconds:>11.1f}")
+
+    image = rng.integers(0, 10000, (args.BANDS, args.IMAGE_SIZE, args.IMAGE_SIZE), dtype=np.uint16)
+    print(f"{'model':<10}{'image MB':>10}{'staging MB':>12}{'seconds':>10}{'tiles/s':>10}")
+    reference = None
+    for dtype in (np.float32, np.uint16):
+        model           = build_model(args)
+        scene           = image.astype(dtype)
+        report          = model.new_report()
+        result, seconds = timed(model.predict_large_image, scene, tile_size=args.TILE_SIZE)
+        reference       = result if reference is None else reference
+        print(f"{np.dtype(dtype).name:<10}{scene.nbytes/1024**2:>10.1f}{report.stats['staging_mb']:>12.1f}{seconds:>10.2f}"
+              f"{model.run_stats['tiles']/seconds:>10.1f}{'' if np.array_equal(result, reference) else '  (result differs!)'}")
+
+
+# Single process with growing intra-op thread count vs. worker pool with the same total core count
+def bench_cpu_pool(args):
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    image = np.random.rand(args.BANDS, args.IMAGE_SIZE, args.IMAGE_SIZE).astype(np.float32)
+    model = build_model(args)
+
+    counts = sorted({1, 2, 4, 8, 16, 32, 64, cores} & set(range(1, cores + 1)))
+    print(f"{'mode':<10}{'procs':>6}{'threads':>9}{'seconds':>10}{'tiles/s':>10}")
+
+    reference = None
+    for threads in counts:
+        torch.set_num_threads(threads)
+        result, seconds = timed(model.predict_large_image, image)
+        reference       = result if reference is None else reference
+        tiles           = model.run_stats['tiles']
+        print(f"{'threads':<10}{1:>6}{threads:>9}{seconds:>10.2f}{tiles/seconds:>10.1f}")
+
+    for workers in counts[1:]:
+        model.workers   = workers
+        result, seconds = timed(model.predict_large_image, image)
+        tiles           = model.run_stats['tiles']
+        print(f"{'pool':<10}{workers:>6}{max(cores // workers, 1):>9}{seconds:>10.2f}{tiles/seconds:>10.1f}"
+              f"{'' if np.array_equal(result, reference) else '  (result differs!)'}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.MODE not in ('cog', 'dataset') and not args.MODEL_PATH:
+        parser.error(f"--MODEL_PATH is required for --MODE {args.MODE}")
+    if args.MODE == 'cpu_pool':
+        bench_cpu_pool(args)
+    elif args.MODE == 'precision':
+        bench_precision(args)
+    elif args.MODE == 'quantize':
+        bench_quantize(args)
+    elif args.MODE == 'onnx':
+        bench_onnx(args)
+    elif args.MODE == 'compile':
+        bench_compile(args)
+    elif args.MODE == 'cog':
+        bench_cog(args)
+    elif args.MODE == 'dataset':
+        bench_dataset(args)
+    elif args.MODE == 'dtype':
+        bench_dtype(args)
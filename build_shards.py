@@ -0,0 +1,28 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/8/16} ${15:40}
+# @Function   : pack images/ and labels/ of the annotated splits into memory-mapped training shards
+# @Description: python build_shards.py --DATASET_PATH ./datasets/ --SHARD_PATH ./datasets/shards/ --SPLITS train val
+#               then python train.py ... --SHARD_PATH ./datasets/shards/
+
+
+import argparse
+
+from utils.shards import build_shards
+from utils.labels import load_label_map
+
+
+parser = argparse.ArgumentParser(description="Decode, preprocess and pack annotations/<split>.txt samples into binary shards")
+parser.add_argument('--DATASET_PATH',   type=str,   default='./datasets/')
+parser.add_argument('--SHARD_PATH',     type=str,   default='./datasets/shards/')
+parser.add_argument('--SPLITS',         type=str,   default=['train','val'], nargs='+')
+parser.add_argument('--SHARD_MB',       type=int,   default=1024)       # size of one .bin file, 0 packs a split in a single file
+parser.add_argument('--LABEL_MAP',      type=str,   default=None)       # JSON {raster value: class}, default DATASET_PATH/label_map.json
+
+
+if __name__ == '__main__':
+    args      = parser.parse_args()
+    label_map = load_label_map(args.DATASET_PATH, args.LABEL_MAP)
+    for split in args.SPLITS:
+        build_shards(args.DATASET_PATH, args.SHARD_PATH, split, args.SHARD_MB, label_map=label_map)
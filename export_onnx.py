@@ -0,0 +1,89 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/7/28} ${15:45}
+# @Function   : export trained models to ONNX
+# @Description: python export_onnx.py --MODEL_TYPE upernet --MODEL_PATH ./pth_files/xxx.pth --BANDS 10
+#               the .onnx file is written next to the .pth and used by Model(..., backend='onnxruntime')
+
+
+import inspect
+import argparse
+import torch
+import torch.nn as nn
+
+from Structure         import Model
+from utils.ort_backend import onnx_path_for
+
+
+parser = argparse.ArgumentParser(description="Export Structure.Model networks to ONNX with a dynamic batch axis")
+parser.add_argument('--MODEL_PATH',     type=str,   required=True)
+parser.add_argument('--MODEL_TYPE',     type=str,   default='upernet',  choices=['unet','deeplab','enet','pspnet','hrnet','segnet','refinenet','fcn','segformer','setr','upernet','ocrnet','mask2former','segnext'])
+parser.add_argument('--BACKBONE_TYPE',  type=str,   default=None)
+parser.add_argument('--ATTENTION_TYPE', type=str,   default=None)
+parser.add_argument('--BANDS',          type=int,   default=10)
+parser.add_argument('--NUM_CLASS',      type=int,   default=3)
+parser.add_argument('--IMG_SIZE',       type=int,   default=256)
+parser.add_argument('--OPSET',          type=int,   default=17)
+parser.add_argument('--DYNAMIC_HW',     action='store_true',      help='also make height/width dynamic (fully convolutional models only)')
+parser.add_argument('--OUTPUT',         type=str,   default=None)
+
+
+class MatmulAdaptiveAvgPool2d(nn.Module):
+    """
+    AdaptiveAvgPool2d written as P_h @ x @ P_w^T with averaging matrices. The ONNX exporter rejects adaptive pooling
+    whose output size does not divide the input (the [1, 2, 3, 6] pyramid pooling on an 8×8 Swin map in UperNet).
+    """
+
+    def __init__(self, output_size):
+        super(MatmulAdaptiveAvgPool2d, self).__init__()
+        self.output_size = (output_size, output_size) if isinstance(output_size, int) else tuple(output_size)
+
+    # Same bins as adaptive pooling: [floor(i*n/out), ceil((i+1)*n/out))
+    @staticmethod
+    def pooling_matrix(n_in, n_out, dtype):
+        matrix = torch.zeros(n_out, n_in, dtype=dtype)
+        for i in range(n_out):
+            start = (i * n_in) // n_out
+            end   = -(-((i + 1) * n_in) // n_out)
+            matrix[i, start:end] = 1.0 / (end - start)
+        return matrix
+
+    def forward(self, x):
+        h, w   = int(x.shape[-2]), int(x.shape[-1])
+        oh, ow = [size or dim for size, dim in zip(self.output_size, (h, w))]
+        return self.pooling_matrix(h, oh, x.dtype) @ x @ self.pooling_matrix(w, ow, x.dtype).t()
+
+
+# Swap adaptive average pooling layers (except global pooling) for the exportable matmul version, in place
+def make_exportable(net):
+    for name, child in net.named_children():
+        if isinstance(child, nn.AdaptiveAvgPool2d) and child.output_size not in (1, (1, 1)):
+            setattr(net, name, MatmulAdaptiveAvgPool2d(child.output_size))
+        else:
+            make_exportable(child)
+    return net
+
+
+def export(net, bands, img_size, output_path, opset=17, dynamic_hw=False):
+    axes  = {0: 'batch', 2: 'height', 3: 'width'} if dynamic_hw else {0: 'batch'}
+    dummy = torch.randn(2, bands, img_size, img_size)
+    extra = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(net, dummy, output_path, input_names=['image'], output_names=['logits'],
+                      dynamic_axes={'image': axes, 'logits': axes}, opset_version=opset, **extra)
+    print(f"ONNX model saved in : {output_path}")
+
+
+def main():
+    args  = parser.parse_args()
+    model = Model(model_path=args.MODEL_PATH, bands=args.BANDS, num_class=args.NUM_CLASS, model_type=args.MODEL_TYPE,
+                  backbone=args.BACKBONE_TYPE, atten_type=args.ATTENTION_TYPE, img_size=args.IMG_SIZE)
+    net   = model.model.module if isinstance(model.model, nn.DataParallel) else model.model
+    net   = make_exportable(net.cpu().eval())
+
+    with torch.no_grad():
+        export(net, args.BANDS, args.IMG_SIZE, args.OUTPUT or onnx_path_for(args.MODEL_PATH), args.OPSET, args.DYNAMIC_HW)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/8/02} ${21:15}
+# @Function   : load-test client of serve.py, replays a directory of .npy / .tif tiles with concurrent requests
+# @Description: python load_test.py --TILE_DIR ./test_sample --URL http://127.0.0.1:8000 --CONCURRENCY 16 --REPEAT 2
+
+
+import os
+import json
+import time
+import argparse
+import urllib.request
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+parser = argparse.ArgumentParser(description="Replay a directory of tiles against the inference server")
+parser.add_argument('--TILE_DIR',    type=str, required=True)
+parser.add_argument('--URL',         type=str, default='http://127.0.0.1:8000')
+parser.add_argument('--CONCURRENCY', type=int, default=16)
+parser.add_argument('--REPEAT',      type=int, default=1)
+
+
+def load_tiles(tile_dir):
+    paths = sorted(os.path.join(tile_dir, f) for f in os.listdir(tile_dir) if f.lower().endswith(('.npy', '.tif', '.tiff')))
+    if not paths:
+        raise FileNotFoundError(f"No .npy / .tif tiles in : {tile_dir}")
+    tiles = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            tiles.append(f.read())
+    return tiles
+
+
+def post(url, data):
+    request = urllib.request.Request(url + '/predict', data=data, method='POST')
+    start   = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    args  = parser.parse_args()
+    tiles = load_tiles(args.TILE_DIR) * args.REPEAT
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.CONCURRENCY) as pool:
+        latencies = np.array(list(pool.map(lambda data: post(args.URL, data), tiles))) * 1000
+    seconds = time.perf_counter() - start
+
+    with urllib.request.urlopen(args.URL + '/stats') as response:
+        server = json.loads(response.read())
+
+    print(f"{len(tiles)} requests, concurrency {args.CONCURRENCY}: {len(tiles)/seconds:.1f} tiles/s")
+    print(f"client latency ms  p50 {np.percentile(latencies, 50):.1f}  p90 {np.percentile(latencies, 90):.1f}  p99 {np.percentile(latencies, 99):.1f}")
+    print(f"server latency ms  p50 {server['p50_ms']:.1f}  p90 {server['p90_ms']:.1f}  p99 {server['p99_ms']:.1f}  mean batch {server['mean_batch']:.2f}")
@@ -9,7 +9,6 @@
 
 import torch
 import torch.nn as nn
-import numpy    as np
 import torch.nn.functional as F
 from timm.layers import DropPath, to_2tuple, trunc_normal_
 
@@ -564,7 +563,6 @@ class SwinTransformer(nn.Module):
             x = torch.flatten(x, 1)
             return x
         else:
-            print(len(features))
             return features
 
     def forward(self, x):
@@ -779,9 +777,10 @@ class UperNet(nn.Module):
         input_size = (x.size()[2], x.size()[3])
 
         features = self.backbone(x)
+        # Stage i tokens are on a (H/4/2^i, W/4/2^i) grid, static ints keep the graph exportable with a dynamic batch axis
+        res_h, res_w = self.backbone.patches_resolution
         for i in range(len(features)):
-            h = int(np.sqrt(features[i].shape[1]))
-            features[i] = features[i].view(features[i].shape[0], h, h, features[i].shape[2])
+            features[i] = features[i].view(-1, res_h >> i, res_w >> i, self.backbone.embed_dim << i)
             if i != len(features) - 1:
                features[i] = features[i].permute(0,3,1,2)
             #print('after backbone, features i shape: ', features[i].shape)
@@ -1,11 +1,13 @@
 import gdal
-from Structure import Model
+from Structure import Model, NODATA_CLASS
 import numpy as np
 import rasterio
-from rasterio.features import shapes
-import geopandas as gpd
-from shapely.geometry import shape
+from rasterio.transform import Affine
+from rasterio.crs import CRS
+from utils.vectorize import polygonize
+from utils.cog import COGWriter
 import os
+import time
 
 # encoding = utf-8
 
@@ -22,7 +24,7 @@ import numpy as np
 gdal.UseExceptions()
 
 
-# Read multi_spectral image raster data and geo_coordinate info.
+# Read multi_spectral image raster data (source dtype, e.g. uint16) and geo_coordinate info.
 def read_multiband_image(image_path):
     dataset = gdal.Open(image_path)
     if dataset is None:
@@ -31,11 +33,14 @@ def read_multiband_image(image_path):
     bands  = dataset.RasterCount
     height = dataset.RasterYSize
     width  = dataset.RasterXSize
-    image  = np.zeros((bands, height, width), dtype=np.float32)
+    image  = None
 
     for i in range(bands):
         band         = dataset.GetRasterBand(i+1)
-        image[i,:,:] = band.ReadAsArray()
+        data         = band.ReadAsArray()
+        if image is None:
+            image    = np.empty((bands, height, width), dtype=data.dtype)
+        image[i,:,:] = data
 
     geotransform = dataset.GetGeoTransform()
     projection   = dataset.GetProjection()    
@@ -43,80 +48,184 @@ def read_multiband_image(image_path):
     return image, geotransform, projection
 
 
-# Transfer tiff prediction result to shape file
-def raster_tif_to_shp(tif_path, shp_dir, ignore_class=0, epsg_code=None):
-    label_map = {
-        1: "clean_glacier",
-        2: "debris_glacier"
-    }
+# Nodata value of the first band, None if the raster has none
+def read_nodata_value(image_path):
+    dataset = gdal.Open(image_path)
+    nodata  = dataset.GetRasterBand(1).GetNoDataValue()
+    dataset = None
+    return nodata
 
-    if not os.path.exists(shp_dir):
-        os.makedirs(shp_dir)
-
-    base_name = os.path.splitext(os.path.basename(tif_path))[0]
-    shp_path  = os.path.join(shp_dir, f"{base_name}.shp")
 
+# Transfer tiff prediction result to shape file, blocks are read and polygonized by `workers` processes
+def raster_tif_to_shp(tif_path, shp_dir, ignore_class=0, epsg_code=None, workers=None, block_rows=1024):
     with rasterio.open(tif_path) as src:
-        image      = src.read(1)
+        height     = src.height
         transform  = src.transform
         raster_crs = src.crs
 
-    unique_values = np.unique(image)
-    unique_values = unique_values[unique_values != ignore_class]
+    base_name = os.path.splitext(os.path.basename(tif_path))[0]
+    os.makedirs(shp_dir, exist_ok=True)
+    shp_path  = os.path.join(shp_dir, f"{base_name}.shp")
+    count     = polygonize(tif_path, height, transform, raster_crs.to_wkt() if raster_crs else None, shp_path,
+                           [ignore_class, NODATA_CLASS], epsg_code=epsg_code, workers=workers, block_rows=block_rows)
+    report_shapefile(shp_path, count)
+    return count
 
-    if len(unique_values) == 0:
-        print("No valid classes found in the prediction.")
-        return
 
-    all_geometries = []
-    all_class_ids  = []
-    all_labels     = []
+# Transfer in-memory prediction to shape file, transform is a rasterio Affine and raster_crs a rasterio CRS
+def raster_array_to_shp(image, transform, raster_crs, shp_dir, base_name, ignore_class=0, epsg_code=None, workers=None, block_rows=1024):
+    os.makedirs(shp_dir, exist_ok=True)
+    shp_path = os.path.join(shp_dir, f"{base_name}.shp")
+    count    = polygonize(image, image.shape[0], transform, raster_crs.to_wkt() if raster_crs else None, shp_path,
+                          [ignore_class, NODATA_CLASS], epsg_code=epsg_code, workers=workers, block_rows=block_rows)
+    report_shapefile(shp_path, count)
+    return count
 
-    for class_value in unique_values:
-        mask = image == class_value
-        shapes_generator = shapes(image.astype(np.uint8), mask=mask, transform=transform)
-        for geom, value in shapes_generator:
-            if value == class_value:
-                all_geometries.append(shape(geom))
-                all_class_ids.append(int(class_value))
-                all_labels.append(label_map.get(int(class_value), "unknown"))
 
-    if len(all_geometries) == 0:
+def report_shapefile(shp_path, count):
+    if count == 0:
         print("No geometries extracted.")
-        return
-
-    gdf = gpd.GeoDataFrame({
-        "class_id": all_class_ids,
-        "label": all_labels,
-        "geometry": all_geometries
-    }, crs=raster_crs)
-
-    if epsg_code:
-        gdf = gdf.to_crs(epsg=f"EPSG:{epsg_code}")
-
-    gdf.to_file(shp_path, driver="ESRI Shapefile")
-    print(f"Shapefile saved in: {shp_path}, total objects: {len(gdf)}")
+    else:
+        print(f"Shapefile saved in: {shp_path}, total objects: {count}")
 
 # Save prediction as tif file.
-def save_prediction_as_geotiff(prediction, geotransform, projection, output_path):
+def save_prediction_as_geotiff(prediction, geotransform, projection, output_path, nodata=None):
     height, width = prediction.shape
     driver        = gdal.GetDriverByName('GTiff')
     dataset       = driver.Create(output_path, width, height, 1, gdal.GDT_Byte)
     
     dataset.SetGeoTransform(geotransform)
     dataset.SetProjection(projection)
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
     dataset.GetRasterBand(1).WriteArray(prediction)
     dataset.FlushCache()
     dataset = None
     print(f"Prediction already saved with GeoTIFF in : {output_path}")
 
 
-def main(model_cfg, model_path, input_image_path, output_tiff_path, output_png_path, shape_out_dir):
+# Save prediction as Cloud Optimized GeoTIFF (tiled, compressed, mode overviews)
+def save_prediction_as_cog(prediction, geotransform, projection, output_path, nodata=None):
+    height, width = prediction.shape
+    writer        = COGWriter(output_path, width, height, geotransform, projection, nodata=nodata)
+    writer.write(prediction)
+    writer.close()
+    print(f"Prediction already saved with COG in : {output_path}")
+
+
+# Streaming prediction: windows are read with ReadAsArray(xoff, yoff, ...) and finished rows are written as they complete.
+# The palette rendering of every finished row is written to rgb_path (3-band GeoTIFF) in the same pass.
+# With cog=True the class raster goes through COGWriter, rows are compressed into tiles as they finish.
+def predict_geotiff_streaming(model, image_path, output_path, memory_mb=1024, tile_size=256, overlap=64, rgb_path=None, cog=False):
+    src = gdal.Open(image_path)
+    if src is None:
+        raise FileNotFoundError(f"Can't Open file in : {image_path}")
+
+    bands    = src.RasterCount
+    height   = src.RasterYSize
+    width    = src.RasterXSize
+    itemsize = gdal.GetDataTypeSize(src.GetRasterBand(1).DataType) // 8
+    print(f"Image dimension: {height}x{width}, bands num: {bands}, memory budget: {memory_mb}MB")
+
+    driver   = gdal.GetDriverByName('GTiff')
+    nodata   = src.GetRasterBand(1).GetNoDataValue()
+    if cog:
+        dst      = COGWriter(output_path, width, height, src.GetGeoTransform(), src.GetProjection(),
+                             nodata=NODATA_CLASS if model.skip_empty else None)
+        out_band = dst.band
+    else:
+        dst      = driver.Create(output_path, width, height, 1, gdal.GDT_Byte, options=['BIGTIFF=IF_SAFER'])
+        dst.SetGeoTransform(src.GetGeoTransform())
+        dst.SetProjection(src.GetProjection())
+        out_band = dst.GetRasterBand(1)
+        if model.skip_empty:
+            out_band.SetNoDataValue(NODATA_CLASS)
+
+    rgb      = None
+    if rgb_path:
+        rgb  = driver.Create(rgb_path, width, height, 3, gdal.GDT_Byte, options=['BIGTIFF=IF_SAFER', 'PHOTOMETRIC=RGB'])
+        rgb.SetGeoTransform(src.GetGeoTransform())
+        rgb.SetProjection(src.GetProjection())
+
+    def read_window(xoff, yoff, xsize, ysize):
+        return src.ReadAsArray(xoff, yoff, xsize, ysize)
+
+    def write_rows(rows, yoff):
+        out_band.WriteArray(rows, 0, yoff)
+        if rgb is not None:
+            colors = model.colorize(rows)
+            for i in range(3):
+                rgb.GetRasterBand(i+1).WriteArray(colors[:, :, i], 0, yoff)
+
+    model.predict_large_raster(read_window, write_rows, bands, height, width, tile_size=tile_size,
+                               overlap=overlap, memory_mb=memory_mb, itemsize=itemsize, nodata=nodata)
+    out_band = None
+    with model.report.stage('write'):
+        if cog:
+            dst.close()
+        else:
+            dst.FlushCache()
+        dst = None
+        if rgb is not None:
+            rgb.FlushCache()
+            rgb = None
+    src = None
+    print(f"Prediction already saved with GeoTIFF in : {output_path}")
+
+
+def main(model_cfg, model_path, input_image_path, output_tiff_path, output_png_path, shape_out_dir, stream=False, memory_mb=1024):
+    screen = None
+    if model_cfg.get("screen"):
+        screen = Model(model_path=model_cfg["screen"]["model_path"], bands=model_cfg["bands"], num_class=model_cfg["num_classes"],
+                       model_type=model_cfg["screen"]["model_type"], backbone=model_cfg["screen"].get("backbone_type"),
+                       atten_type=model_cfg["screen"].get("atten_type"))
+
     model = Model(model_path=model_path, bands=model_cfg["bands"], num_class=model_cfg["num_classes"], 
-                  model_type=model_cfg["model_type"], backbone=model_cfg["backbone_type"], atten_type=model_cfg["atten_type"])
+                  model_type=model_cfg["model_type"], backbone=model_cfg["backbone_type"], atten_type=model_cfg["atten_type"],
+                  skip_empty=model_cfg.get("skip_empty", False), workers=model_cfg.get("workers", 0),
+                  tta=model_cfg.get("tta", 1), tta_budget=model_cfg.get("tta_budget"), precision=model_cfg.get("precision", 'fp32'),
+                  quantize=model_cfg.get("quantize"), backend=model_cfg.get("backend", 'torch'),
+                  compile_mode=model_cfg.get("compile_mode"), tile_memory_mb=model_cfg.get("tile_memory_mb", 2048),
+                  screen=screen, screen_threshold=model_cfg.get("screen_threshold", 0.9),
+                  tile_cache=model_cfg.get("tile_cache"), tile_cache_mb=model_cfg.get("tile_cache_mb", 2048),
+                  progress=print_progress if model_cfg.get("progress") else None, input_scale=model_cfg.get("input_scale"))
+
+    report = model.new_report(image=input_image_path, output=output_tiff_path, stream=stream, config=model_cfg)
+    predict_job(model, model_cfg, input_image_path, output_tiff_path, output_png_path, shape_out_dir, stream, memory_mb)
+    report.save(f"{os.path.splitext(output_tiff_path)[0]}_report.json")
+
+
+def print_progress(done, total):
+    print(f"\rTiles done: {done}/{total} ({done/max(total, 1):.0%})", end='\n' if done >= total else '', flush=True)
+
+
+# Read / predict / write / polygonize one image, every stage is recorded in model.report
+def predict_job(model, model_cfg, input_image_path, output_tiff_path, output_png_path, shape_out_dir, stream, memory_mb):
+    report    = model.report
+    tile_size = model_cfg.get("tile_size", 256)
+
+    if stream:
+        print("Streaming prediction on going....")
+        try:
+            predict_geotiff_streaming(model, input_image_path, output_tiff_path, memory_mb=memory_mb, tile_size=tile_size,
+                                      rgb_path=output_png_path, cog=model_cfg.get("cog", False))
+        except Exception as e:
+            print(f"Faile to predict image: {e}")
+            return
+
+        try:
+            start = time.perf_counter()
+            count = raster_tif_to_shp(tif_path=output_tiff_path, shp_dir=shape_out_dir)
+            report.add('polygonize', time.perf_counter() - start, items=count)
+        except Exception as e:
+            print(f"Failed to transfer into shapefile: {e}")
+        return
 
     try:
+        start                           = time.perf_counter()
         image, geotransform, projection = read_multiband_image(input_image_path)
+        nodata                          = read_nodata_value(input_image_path)
+        report.add('read', time.perf_counter() - start, bytes_read=image.nbytes)
         print(f"Image dimension: {image.shape[1]}x{image.shape[2]}, bands num: {image.shape[0]}")
     except Exception as e:
         print(f"Faile to read image: {e}")
@@ -124,21 +233,28 @@ def main(model_cfg, model_path, input_image_path, output_tiff_path, output_png_p
 
     print("Prediction on going....")
     try:
-        predicted_result     = model.predict_large_image(image)
-        predicted_png_result = model.get_large_predict_png(image)
+        predicted_result     = model.predict_large_image(image, tile_size=tile_size, nodata=nodata)
+        predicted_png_result = model.get_large_predict_png(None, mask=predicted_result)
     except Exception as e:
         print(f"Faile to predict image: {e}")
         return
 
     try:
+        start     = time.perf_counter()
         predicted_png_result.save(output_png_path)
-        save_prediction_as_geotiff(predicted_result, geotransform, projection, output_tiff_path)
+        save_tiff = save_prediction_as_cog if model_cfg.get("cog", False) else save_prediction_as_geotiff
+        save_tiff(predicted_result, geotransform, projection, output_tiff_path, nodata=NODATA_CLASS if model.skip_empty else None)
+        report.add('write', time.perf_counter() - start, bytes_written=os.path.getsize(output_png_path) + os.path.getsize(output_tiff_path))
     except Exception as e:
         print(f"Faile to save prediction: {e}")
         return
     
     try:
-        raster_tif_to_shp(tif_path=output_tiff_path, shp_dir=shape_out_dir)
+        start     = time.perf_counter()
+        base_name = os.path.splitext(os.path.basename(output_tiff_path))[0]
+        count     = raster_array_to_shp(predicted_result, Affine.from_gdal(*geotransform), CRS.from_wkt(projection) if projection else None,
+                                        shape_out_dir, base_name)
+        report.add('polygonize', time.perf_counter() - start, items=count)
     except Exception as e:
         print(f"Failed to transfer into shapefile: {e}")
         return
@@ -158,10 +274,32 @@ if __name__ == "__main__":
         "num_classes" : 3,
         "model_type" : 'unet',
         "backbone_type": 'vgg11',
-        "atten_type": None
+        "atten_type": None,
+        "skip_empty": True,       # nodata / constant tiles are written as NODATA_CLASS without forward pass
+        "workers": 0,             # >1: CPU worker processes pinned to core slices (ignored on GPU)
+        "tta": 1,                 # flip/rotate views per tile (1-8), averaged in one batched forward pass
+        "tta_budget": None,       # seconds per scene, the number of TTA views is reduced to fit
+        "precision": 'fp32',      # fp32/bf16/fp16, reduced precision runs under autocast
+        "quantize": None,         # 'dynamic': int8 Linear layers (upernet/setr/segformer/mask2former), cached next to the .pth
+                                  # 'static' : calibrated int8 CNN (unet/deeplab/pspnet/segnet) produced by quantize.py
+        "backend": 'torch',       # 'onnxruntime': run the .onnx written by export_onnx.py next to the .pth
+        "compile_mode": None,     # 'torchscript'/'inductor': compiled graphs cached in ./compile_cache, warm on the next run
+        "tile_size": 256,         # 'auto': fastest tile/batch size within tile_memory_mb, cached in ./autotune_cache.json
+        "tile_memory_mb": 2048,   # activation memory budget of the auto-tuning
+        "screen": None,           # e.g. {"model_type": 'segnext', "model_path": './pth_files/segnext.pth'} (SegNeXt-T): cheap model screens every tile,
+                                  # only mixed or uncertain tiles (mean confidence < screen_threshold) run through the model above
+        "screen_threshold": 0.9,
+        "cog": False,             # True: tiled, DEFLATE compressed Cloud Optimized GeoTIFF with MODE overviews
+        "tile_cache": None,       # e.g. './tile_cache': tiles already predicted by the same checkpoint skip the forward pass
+        "tile_cache_mb": 2048,    # size bound of the tile cache, least recently used tiles are evicted
+        "progress": False,        # True: live tile progress on the console; the stage report is saved as <output>_report.json
+        "input_scale": None       # e.g. 1e-4: uint16 reflectance scaled after the float32 conversion on the model device,
+                                  # must match --INPUT_SCALE of training
     }
 
     img_name      = os.path.splitext(os.path.basename(img_in_path))[0]
     seg_out_path  = os.path.join(result_dir, f"seg_{img_name}_class.tif")
     seg_png_path  = os.path.join(result_dir, f"seg_{img_name}_png.tiff")
-    main(cfg, model_path, img_in_path, seg_out_path, seg_png_path, shp_dir)
\ No newline at end of file
+    stream        = False       # True for scenes larger than RAM, peak memory is bounded by memory_mb
+    memory_mb     = 1024
+    main(cfg, model_path, img_in_path, seg_out_path, seg_png_path, shp_dir, stream=stream, memory_mb=memory_mb)
\ No newline at end of file
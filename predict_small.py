@@ -8,12 +8,13 @@
 from Structure import Model
 
 import os
+import time
 import gdal
 import numpy as np
 gdal.UseExceptions()
 
 
-# Read multi_spectral image raster data and geo_coordinate info.
+# Read multi_spectral image raster data (source dtype, e.g. uint16) and geo_coordinate info.
 def read_multiband_image(image_path):
     dataset = gdal.Open(image_path)
     if dataset is None:
@@ -22,11 +23,14 @@ def read_multiband_image(image_path):
     bands  = dataset.RasterCount
     height = dataset.RasterYSize
     width  = dataset.RasterXSize
-    image  = np.zeros((bands, height, width), dtype=np.float32)
+    image  = None
 
     for i in range(bands):
         band         = dataset.GetRasterBand(i+1)
-        image[i,:,:] = band.ReadAsArray()
+        data         = band.ReadAsArray()
+        if image is None:
+            image    = np.empty((bands, height, width), dtype=data.dtype)
+        image[i,:,:] = data
 
     geotransform = dataset.GetGeoTransform()
     projection   = dataset.GetProjection()    
@@ -50,10 +54,14 @@ def save_prediction_as_geotiff(prediction, geotransform, projection, output_path
 
 def main(model_cfg, model_path, input_image_path, output_tiff_path, output_png_path):
     model = Model(model_path=model_path, bands=model_cfg["bands"], num_class=model_cfg["num_classes"], 
-                  model_type=model_cfg["model_type"], backbone=model_cfg["backbone_type"], atten_type=model_cfg["atten_type"])
+                  model_type=model_cfg["model_type"], backbone=model_cfg["backbone_type"], atten_type=model_cfg["atten_type"],
+                  batch_size=1, compile_mode=model_cfg.get("compile_mode"), input_scale=model_cfg.get("input_scale"))
+    report = model.new_report(image=input_image_path, output=output_tiff_path, config=model_cfg)
 
     try:
+        start                           = time.perf_counter()
         image, geotransform, projection = read_multiband_image(input_image_path)
+        report.add('read', time.perf_counter() - start, bytes_read=image.nbytes)
         print(f"Image dimension: {image.shape[1]}x{image.shape[2]}, bands num: {image.shape[0]}")
     except Exception as e:
         print(f"Faile to read image: {e}")
@@ -62,16 +70,19 @@ def main(model_cfg, model_path, input_image_path, output_tiff_path, output_png_p
     print("Prediction on going....")
     try:
         predicted_result     = model.predict_small_patch(image)
-        predicted_png_result = model.get_small_predict_png(image)
+        predicted_png_result = model.get_small_predict_png(None, mask=predicted_result)
     except Exception as e:
         print(f"Faile to predict image: {e}")
         return
 
     try:
+        start = time.perf_counter()
         predicted_png_result.save(output_png_path)
         save_prediction_as_geotiff(predicted_result, geotransform, projection, output_tiff_path)
+        report.add('write', time.perf_counter() - start, bytes_written=os.path.getsize(output_png_path) + os.path.getsize(output_tiff_path))
     except Exception as e:
         print(f"Faile to save prediction: {e}")
+    report.save(f"{os.path.splitext(output_tiff_path)[0]}_report.json")
     
 
 if __name__ == "__main__":
@@ -86,7 +97,8 @@ if __name__ == "__main__":
         "num_classes" : 3,
         "model_type" : 'segnext',
         "backbone_type": 'vgg11',
-        "atten_type": None
+        "atten_type": None,
+        "compile_mode": None      # 'torchscript'/'inductor': compiled graphs cached in ./compile_cache, warm on the next run
     }
 
     img_name      = os.path.splitext(os.path.basename(img_in_path))[0]
@@ -0,0 +1,81 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/7/26} ${10:20}
+# @Function   : static int8 quantization of CNN segmentation models
+# @Description: python quantize.py --MODEL_TYPE unet --BACKBONE_TYPE vgg11 --MODEL_PATH ./pth_files/xxx.pth --CALIB_TILES 64
+#               the calibrated model is saved next to the .pth and loaded by Model(..., quantize='static')
+
+
+import os
+import time
+import argparse
+import torch
+import torch.nn as nn
+
+from torch.utils.data   import DataLoader
+from Structure          import Model
+from utils.dataset      import Labeled_Model_Dataset
+from utils.input_stage  import to_model_input
+from utils.quantization import STATIC_QUANT_TYPES, static_quantize, save_cached_quantized
+
+
+parser = argparse.ArgumentParser(description="Graph-mode static int8 quantization with calibration on annotations/val.txt")
+parser.add_argument('--MODEL_PATH',     type=str,   required=True)
+parser.add_argument('--MODEL_TYPE',     type=str,   default='unet',     choices=STATIC_QUANT_TYPES)
+parser.add_argument('--BACKBONE_TYPE',  type=str,   default='vgg11')
+parser.add_argument('--ATTENTION_TYPE', type=str,   default=None)
+parser.add_argument('--BANDS',          type=int,   default=10)
+parser.add_argument('--NUM_CLASS',      type=int,   default=3)
+parser.add_argument('--DATASET_PATH',   type=str,   default='./datasets/')
+parser.add_argument('--CALIB_TILES',    type=int,   default=64)
+parser.add_argument('--BATCH_SIZE',     type=int,   default=8)
+parser.add_argument('--BACKEND',        type=str,   default='x86',      choices=['x86','fbgemm','qnnpack'])
+parser.add_argument('--INPUT_SCALE',    type=float, default=None)       # same as --INPUT_SCALE of train.py
+
+
+# Seconds per tile of `net` over the calibration batches (one warmup batch)
+def time_per_tile(net, batches):
+    with torch.no_grad():
+        net(batches[0])
+        start = time.perf_counter()
+        for batch in batches:
+            net(batch)
+    return (time.perf_counter() - start) / sum(batch.shape[0] for batch in batches)
+
+
+def main():
+    args  = parser.parse_args()
+    model = Model(model_path=args.MODEL_PATH, bands=args.BANDS, num_class=args.NUM_CLASS, model_type=args.MODEL_TYPE,
+                  backbone=args.BACKBONE_TYPE, atten_type=args.ATTENTION_TYPE)
+    net   = model.model.module if isinstance(model.model, nn.DataParallel) else model.model
+    net   = net.cpu().eval()
+
+    with open(os.path.join(args.DATASET_PATH, "annotations/val.txt"), "r") as f:
+        val_lines = f.readlines()
+    loader  = DataLoader(Labeled_Model_Dataset(val_lines, args.DATASET_PATH), batch_size=args.BATCH_SIZE, shuffle=False)
+    batches = []
+    for image, _ in loader:
+        batches.append(to_model_input(image, args.INPUT_SCALE, nan=0.0))
+        if sum(batch.shape[0] for batch in batches) >= args.CALIB_TILES:
+            break
+    print(f"Calibrating on {sum(batch.shape[0] for batch in batches)} tiles from annotations/val.txt...")
+
+    try:
+        quantized = static_quantize(net, batches, backend=args.BACKEND)
+    except Exception as e:
+        print(f"Failed to quantize {args.MODEL_TYPE}: {e}")
+        return
+    save_cached_quantized(quantized, args.MODEL_PATH, 'static')
+
+    float_t = time_per_tile(net, batches)
+    int8_t  = time_per_tile(quantized, batches)
+    with torch.no_grad():
+        agree = sum((net(b).argmax(1) == quantized(b).argmax(1)).float().sum().item() for b in batches)
+    total = sum(b.shape[0] * b.shape[2] * b.shape[3] for b in batches)
+    print(f"float32: {float_t*1000:.2f} ms/tile, int8: {int8_t*1000:.2f} ms/tile, speedup: {float_t/int8_t:.2f}x "
+          f"on {torch.get_num_threads()} threads, pixel agreement: {agree/total:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# encoding = utf-8
+
+# @Author     ：Lecheng Wang
+# @Time       : ${2025/8/02} ${20:40}
+# @Function   : local HTTP inference server, concurrent requests are merged into micro-batches of one loaded model
+# @Description: python serve.py --MODEL_TYPE unet --BACKBONE_TYPE vgg11 --MODEL_PATH ./pth_files/xxx.pth --MAX_BATCH 8 --MAX_LATENCY_MS 20
+#               POST /predict (.npy [C, H, W] or GeoTIFF body) ; GET /health ; GET /queue ; GET /stats
+#               with --MODEL_DIR ./pth_files/ : POST /predict?checkpoint=xxx.pth runs that checkpoint, at most --POOL_SIZE stay loaded
+
+
+import argparse
+
+from http.server      import ThreadingHTTPServer
+from utils.serving    import MicroBatcher, InferenceHandler
+from utils.model_pool import ModelPool
+
+
+parser = argparse.ArgumentParser(description="Local inference server of Structure.Model")
+parser.add_argument('--MODEL_PATH',     type=str,   required=True)
+parser.add_argument('--MODEL_TYPE',     type=str,   default='unet')
+parser.add_argument('--BACKBONE_TYPE',  type=str,   default='vgg11')
+parser.add_argument('--ATTENTION_TYPE', type=str,   default=None)
+parser.add_argument('--BANDS',          type=int,   default=10)
+parser.add_argument('--NUM_CLASS',      type=int,   default=3)
+parser.add_argument('--TILE_SIZE',      type=int,   default=256)
+parser.add_argument('--MAX_BATCH',      type=int,   default=8)
+parser.add_argument('--MAX_LATENCY_MS', type=float, default=20)
+parser.add_argument('--HOST',           type=str,   default='127.0.0.1')
+parser.add_argument('--PORT',           type=int,   default=8000)
+parser.add_argument('--MODEL_DIR',      type=str,   default=None)       # checkpoints selectable per request with ?checkpoint=
+parser.add_argument('--POOL_SIZE',      type=int,   default=3)          # checkpoints kept loaded, least recently used are evicted
+parser.add_argument('--POOL_MEMORY_MB', type=int,   default=None)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    pool = ModelPool(max_models=args.POOL_SIZE, memory_mb=args.POOL_MEMORY_MB, bands=args.BANDS, num_class=args.NUM_CLASS,
+                     atten_type=args.ATTENTION_TYPE, batch_size=args.MAX_BATCH)
+
+    # Every checkpoint is looked up in the pool per micro-batch, the default one is loaded before serving
+    def make_batcher(model_path):
+        return MicroBatcher(max_batch=args.MAX_BATCH, max_latency_ms=args.MAX_LATENCY_MS, tile_size=args.TILE_SIZE,
+                            get_model=lambda: pool.get(args.MODEL_TYPE, args.BACKBONE_TYPE, model_path))
+
+    pool.get(args.MODEL_TYPE, args.BACKBONE_TYPE, args.MODEL_PATH)
+    InferenceHandler.batcher      = make_batcher(args.MODEL_PATH)
+    InferenceHandler.model_info   = {'model_type': args.MODEL_TYPE, 'backbone': args.BACKBONE_TYPE, 'model_path': args.MODEL_PATH}
+    if args.MODEL_DIR:
+        InferenceHandler.model_dir    = args.MODEL_DIR
+        InferenceHandler.make_batcher = make_batcher
+
+    server = ThreadingHTTPServer((args.HOST, args.PORT), InferenceHandler)
+    print(f"Serving {args.MODEL_TYPE} on http://{args.HOST}:{args.PORT} (max batch {args.MAX_BATCH}, max latency {args.MAX_LATENCY_MS} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
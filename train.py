@@ -8,6 +8,7 @@
 
 import os
 import csv
+import time
 import argparse
 import torch
 import torch.nn             as nn
@@ -38,7 +39,10 @@ from nets.mask2former         import Mask2Former
 
 
 from torch.utils.data         import DataLoader
-from utils.dataset            import Labeled_Model_Dataset
+from utils.dataset            import Labeled_Model_Dataset, Labeled_Shard_Dataset, Scene_Crop_Dataset
+from utils.input_stage        import to_model_input
+from utils.labels             import load_label_map
+from utils.augment            import BatchAugment
 from utils.metrics            import Evaluator
 from utils.weight_init        import weights_init
 from utils.focal              import FocalLoss
@@ -67,6 +71,20 @@ parser.add_argument('--MODEL_TYPE',     type=str,   default='mask2former',   cho
 parser.add_argument('--BACKBONE_TYPE',  type=str,   default=None)       # unet:vgg11/13/16/19、resnet18/34/50/101/152   deeplab:xception/mobilenet/resnet/vggnet/inception
 parser.add_argument('--ATTENTION_TYPE', type=str,   default=None,       choices=['senet','ecanet','cbam','vit','self_atten'])
 parser.add_argument('--INIT_TYPE',      type=str,   default='kaiming',  choices=['kaiming','normal','xavier','orthogonal'])
+parser.add_argument('--NUM_WORKERS',    type=int,   default=4)          # DataLoader worker processes, 0 loads on the training thread
+parser.add_argument('--PREFETCH_FACTOR', type=int,  default=2)          # batches loaded ahead by every worker
+parser.add_argument('--PERSISTENT_WORKERS', type=int, default=1,      choices=[0,1])   # keep workers (and their GDAL handles) across epochs
+parser.add_argument('--HANDLE_CACHE',   type=int,   default=128)        # open GDAL datasets kept per worker
+parser.add_argument('--SHARD_PATH',     type=str,   default=None)       # shards of build_shards.py, read instead of the GeoTIFFs
+parser.add_argument('--SCENE_CROPS',    type=int,   default=0)          # >0: annotations list whole scenes, random crops per scene and epoch
+parser.add_argument('--CROP_SIZE',      type=int,   default=256)
+parser.add_argument('--BLOCK_CACHE_MB', type=int,   default=256)        # decoded raster blocks kept per worker in scene mode
+parser.add_argument('--INPUT_SCALE',    type=float, default=None)       # e.g. 1e-4, applied on the device after the float32 conversion
+parser.add_argument('--AUGMENT',        type=int,   default=0,          choices=[0,1])   # batched flips/rot90/band dropout/jitter of training batches on the device
+parser.add_argument('--AUG_BAND_DROP',  type=float, default=0.05)       # probability of zeroing one band of one sample
+parser.add_argument('--AUG_JITTER',     type=float, default=0.1)        # per band gain 1+-x and offset +-x band std
+parser.add_argument('--AUG_SEED',       type=int,   default=None)       # same seed, same augmentations
+parser.add_argument('--LABEL_MAP',      type=str,   default=None)       # JSON {raster value: class}, default DATASET_PATH/label_map.json (128->1, 255->2 without it)
 
 
 def main ():        
@@ -163,15 +181,29 @@ def main ():
     else:
         raise NotImplementedError('lr scheduler type [%s] is not implemented,cos,step,poly,exp is supported!' %args.LR_SCHEDULER)
 
-    with open(os.path.join(args.DATASET_PATH, "annotations/train.txt"),"r") as f:
-        train_lines = f.readlines()
-    with open(os.path.join(args.DATASET_PATH, "annotations/val.txt"),"r") as f:
-        test_lines  = f.readlines()
-
-    train_datasets  = Labeled_Model_Dataset(train_lines, args.DATASET_PATH)
-    test_datasets   = Labeled_Model_Dataset(test_lines,  args.DATASET_PATH)
-    train_loader    = DataLoader(train_datasets,shuffle=True, batch_size=args.BATCH_SIZE,num_workers=0,pin_memory=True,drop_last=True)
-    test_loader     = DataLoader(test_datasets, shuffle=False,batch_size=args.BATCH_SIZE,num_workers=0,pin_memory=True,drop_last=False)
+    if args.SHARD_PATH:
+        train_datasets  = Labeled_Shard_Dataset(args.SHARD_PATH, 'train')
+        test_datasets   = Labeled_Shard_Dataset(args.SHARD_PATH, 'val')
+    else:
+        with open(os.path.join(args.DATASET_PATH, "annotations/train.txt"),"r") as f:
+            train_lines = f.readlines()
+        with open(os.path.join(args.DATASET_PATH, "annotations/val.txt"),"r") as f:
+            test_lines  = f.readlines()
+
+        label_map       = load_label_map(args.DATASET_PATH, args.LABEL_MAP)
+        if args.SCENE_CROPS > 0:
+            # validation crops are drawn once (fixed seed) so that epochs stay comparable
+            scene_kwargs    = dict(crop_size=args.CROP_SIZE, samples_per_scene=args.SCENE_CROPS, block_cache_mb=args.BLOCK_CACHE_MB, label_map=label_map)
+            train_datasets  = Scene_Crop_Dataset(train_lines, args.DATASET_PATH, **scene_kwargs)
+            test_datasets   = Scene_Crop_Dataset(test_lines,  args.DATASET_PATH, seed=0, **scene_kwargs)
+        else:
+            train_datasets  = Labeled_Model_Dataset(train_lines, args.DATASET_PATH, max_handles=args.HANDLE_CACHE, label_map=label_map)
+            test_datasets   = Labeled_Model_Dataset(test_lines,  args.DATASET_PATH, max_handles=args.HANDLE_CACHE, label_map=label_map)
+    loader_kwargs   = dict(batch_size=args.BATCH_SIZE, num_workers=args.NUM_WORKERS, pin_memory=True)
+    if args.NUM_WORKERS > 0:
+        loader_kwargs.update(prefetch_factor=args.PREFETCH_FACTOR, persistent_workers=bool(args.PERSISTENT_WORKERS))
+    train_loader    = DataLoader(train_datasets,shuffle=True, drop_last=True, **loader_kwargs)
+    test_loader     = DataLoader(test_datasets, shuffle=False,drop_last=False,**loader_kwargs)
 
     cudnn.benchmark = True
 
@@ -182,7 +214,7 @@ def main ():
 
     with open(f'{args.MODEL_TYPE}_training_log.csv', 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(['epoch','train_loss','val_loss','Acc','Kappa','mIoU','mIoU0','mIoU1','mIoU2','FWIoU','Precision','Precision0','Precision1','Precision2','Recall','Recall0','Recall1','Recall2','F1_score','F1_score0','F1_score1','F1_score2','F2_score','F2_score0','F2_score1','F2_score2'])
+        writer.writerow(['epoch','train_loss','val_loss','Acc','Kappa','mIoU','mIoU0','mIoU1','mIoU2','FWIoU','Precision','Precision0','Precision1','Precision2','Recall','Recall0','Recall1','Recall2','F1_score','F1_score0','F1_score1','F1_score2','F2_score','F2_score0','F2_score1','F2_score2','data_wait'])
 
     for epoch in range(trainer.args.EPOCHS):
         print("Start training on GPU:{}...".format(args.GPU_ID))
@@ -201,7 +233,7 @@ def main ():
 
         with open(f'{args.MODEL_TYPE}_training_log.csv', 'a', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow([epoch+1,train_loss,val_loss,Acc,Kappa,mIoU,mIoU0,mIoU1,mIoU2,FWIoU,Precision,Precision0,Precision1,Precision2,Recall,Recall0,Recall1,Recall2,F1_score,F1_score0,F1_score1,F1_score2,F2_score,F2_score0,F2_score1,F2_score2])
+            writer.writerow([epoch+1,train_loss,val_loss,Acc,Kappa,mIoU,mIoU0,mIoU1,mIoU2,FWIoU,Precision,Precision0,Precision1,Precision2,Recall,Recall0,Recall1,Recall2,F1_score,F1_score0,F1_score1,F1_score2,F2_score,F2_score0,F2_score1,F2_score2,trainer.data_wait])
 
 class Trainer(object):
     def __init__(self,args,model,criterion,optimizer,train_loader,val_loader):
@@ -212,22 +244,38 @@ class Trainer(object):
         self.train_loader = train_loader
         self.val_loader   = val_loader
         self.evaluator    = Evaluator(self.args.NUM_CLASS)
+        self.data_wait    = 0.0
+        self.augment      = BatchAugment(band_drop=args.AUG_BAND_DROP, jitter=args.AUG_JITTER, seed=args.AUG_SEED) if args.AUGMENT else None
 
     def training(self, epoch):
         self.model.train()
         train_loss   = 0.0
         train_loader = tqdm(self.train_loader)
         num_batch    = len(self.train_loader)
+        data_wait    = 0.0
+        input_bytes  = 0
+        float_bytes  = 0
+        start        = time.perf_counter()
+        tick         = start
 
         for i, data in enumerate(train_loader):
-            img, lbl = data
-
+            data_wait   += time.perf_counter() - tick
+            img, lbl     = data
+            input_dtype  = img.dtype
+            input_bytes += img.element_size() * img.nelement()
+            float_bytes += 4 * img.nelement()
+
+            # images travel in their source dtype (uint16...) and labels as uint8 through workers and pinned copies,
+            # images become float32 on the device, labels int64 only for the loss
             if self.args.CUDA:
-                img  = img.cuda(self.args.GPU_ID, non_blocking=True).float()
-                lbl  = lbl.cuda(self.args.GPU_ID, non_blocking=True).long()
+                img  = img.cuda(self.args.GPU_ID, non_blocking=True)
+                lbl  = lbl.cuda(self.args.GPU_ID, non_blocking=True)
+            img      = to_model_input(img, self.args.INPUT_SCALE, nan=0.0)
+            if self.augment is not None:
+                img, lbl = self.augment(img, lbl)
 
             output   = self.model(img).float()
-            loss     = self.criterion(output, lbl)
+            loss     = self.criterion(output, lbl.long())
 
             self.optimizer.zero_grad()
             loss.backward()
@@ -235,8 +283,16 @@ class Trainer(object):
 
             train_loss  += loss.item()
             train_loader.set_description('Train loss: %.3f' % (train_loss / (i + 1)))
+            tick         = time.perf_counter()
+
+        # Time the training loop spent waiting for the next batch, a large share means the loader is the bottleneck
+        self.data_wait = data_wait
+        epoch_time     = time.perf_counter() - start
         print('Epoch: %d, numImages: %5d' % (epoch+1, num_batch * self.args.BATCH_SIZE))
         print('Train Loss: %.3f' % (train_loss / num_batch))
+        print('Data wait: %.1fs of %.1fs (%.1f%%)' % (data_wait, epoch_time, 100 * data_wait / max(epoch_time, 1e-9)))
+        if num_batch:
+            print('Input: %.1fMB of %s per epoch, %.1fMB if converted to float32 at read time' % (input_bytes / 1024**2, input_dtype, float_bytes / 1024**2))
         return train_loss/num_batch
 
     def validation(self, epoch):
@@ -250,10 +306,11 @@ class Trainer(object):
             for i, sample in enumerate(val_loader):
                 image, label = sample
                 if torch.cuda.is_available():
-                    image    = image.cuda(self.args.GPU_ID, non_blocking=True).float()
-                    label    = label.cuda(self.args.GPU_ID, non_blocking=True).long()
+                    image    = image.cuda(self.args.GPU_ID, non_blocking=True)
+                    label    = label.cuda(self.args.GPU_ID, non_blocking=True)
+                image        = to_model_input(image, self.args.INPUT_SCALE, nan=0.0)
                 output       = self.model(image).float()
-                loss         = self.criterion(output, label)
+                loss         = self.criterion(output, label.long())
                 val_loss     = val_loss + loss.item()
                 val_loader.set_description('Val loss: %.3f' % (val_loss / (i + 1)))
                 pred         = output.data.cpu().numpy()
@@ -0,0 +1,75 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/20} ${16:10}
+# @Function: batched tensor augmentation of multispectral tiles, run on the model device after collation
+
+
+import torch
+
+
+class BatchAugment:
+    """
+    Augment a whole batch at once: image [N, C, H, W] float (after utils.input_stage.to_model_input), label [N, H, W].
+    flip      : probability of a horizontal and (independently) of a vertical flip, image and label together
+    rot90     : random multiple of 90 degree rotation per sample (square tiles only), image and label together
+    band_drop : probability of zeroing each band of each sample
+    jitter    : per sample and band, gain in [1-jitter, 1+jitter] and offset in +-jitter band standard deviations
+    seed      : random draws come from one generator per device, the same seed gives the same augmentations
+    """
+
+    def __init__(self, flip=0.5, rot90=True, band_drop=0.0, jitter=0.0, seed=None):
+        self.flip       = flip
+        self.rot90      = rot90
+        self.band_drop  = band_drop
+        self.jitter     = jitter
+        self.seed       = seed
+        self.generators = {}
+
+    def generator(self, device):
+        if device not in self.generators:
+            generator = torch.Generator(device=device)
+            if self.seed is None:
+                generator.seed()
+            else:
+                generator.manual_seed(self.seed)
+            self.generators[device] = generator
+        return self.generators[device]
+
+    def rand(self, shape, device):
+        return torch.rand(shape, generator=self.generator(device), device=device)
+
+    # Samples selected by `mask` replaced in place by transform(samples), for image and label alike
+    @staticmethod
+    def apply(mask, transform, image, label):
+        if mask.any():
+            image[mask] = transform(image[mask], (-2, -1))
+            label[mask] = transform(label[mask], (-2, -1))
+
+    def __call__(self, image, label):
+        n, c, h, w = image.shape
+        device     = image.device
+
+        with torch.no_grad():
+            if self.flip or (self.rot90 and h == w):
+                image, label = image.clone(), label.clone()
+
+            if self.flip:
+                flips = self.rand((2, n), device) < self.flip
+                self.apply(flips[0], lambda x, dims: x.flip(dims[1]), image, label)
+                self.apply(flips[1], lambda x, dims: x.flip(dims[0]), image, label)
+
+            if self.rot90 and h == w:
+                turns = (self.rand(n, device) * 4).long()
+                for k in (1, 2, 3):
+                    self.apply(turns == k, lambda x, dims: torch.rot90(x, k, dims), image, label)
+
+            if self.band_drop:
+                keep  = (self.rand((n, c, 1, 1), device) >= self.band_drop).to(image.dtype)
+                image = image * keep
+
+            if self.jitter:
+                gain   = 1 + (self.rand((n, c, 1, 1), device) * 2 - 1) * self.jitter
+                offset = (self.rand((n, c, 1, 1), device) * 2 - 1) * self.jitter * image.std(dim=(2, 3), keepdim=True)
+                image  = image * gain + offset
+        return image, label
@@ -0,0 +1,136 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/05} ${15:30}
+# @Function: tile/batch size auto-tuning under an activation memory budget, cached per (model, machine)
+
+
+import os
+import json
+import time
+import weakref
+import platform
+import torch
+import torch.nn as nn
+
+
+# Swin patch embedding (UperNet) and SETR position embeddings only accept 256x256 tiles
+FIXED_TILE_TYPES = ('upernet', 'setr')
+
+TILE_CANDIDATES  = (256, 512, 1024, 2048)
+BATCH_CANDIDATES = (1, 2, 4, 8, 16)
+
+# Temporaries inside a layer (im2col, attention scores...) are not seen by the output hooks
+MEMORY_MARGIN    = 1.25
+
+
+def machine_id():
+    device = torch.cuda.get_device_name(0) if torch.cuda.is_available() else platform.processor() or platform.machine()
+    return f"{platform.node()}/{device}/{os.cpu_count()}cpu"
+
+
+def model_id(model):
+    mtime = int(os.path.getmtime(model.model_path)) if os.path.isfile(model.model_path) else 0
+    return (f"{model.model_type}/{model.backbone}/{os.path.abspath(model.model_path)}@{mtime}"
+            f"/{model.bands}b/{model.precision}/{model.quantize}/{model.backend}")
+
+
+def activation_peak_bytes(model, batch):
+    """
+    Peak activation memory of one forward pass of `batch` (bytes, weights excluded).
+    CUDA: allocator peak. CPU: largest total size of module outputs alive at the same time, tracked with weakrefs.
+    """
+
+    if model.cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        with torch.no_grad():
+            model._forward(batch.cuda(), pad_to=batch.shape[0])
+        return torch.cuda.max_memory_allocated() - base
+
+    live, state = {}, {'current': 0, 'peak': 0}
+
+    def release(ptr):
+        state['current'] -= live.pop(ptr, 0)
+
+    def hook(module, inputs, output):
+        for t in (output if isinstance(output, (list, tuple)) else [output]):
+            if torch.is_tensor(t) and t.data_ptr() not in live:
+                live[t.data_ptr()]  = t.numel() * t.element_size()
+                state['current']   += live[t.data_ptr()]
+                weakref.finalize(t, release, t.data_ptr())
+        state['peak'] = max(state['peak'], state['current'])
+
+    handles = [m.register_forward_hook(hook) for m in model.model.modules()]
+    try:
+        with torch.no_grad():
+            model._forward(batch, pad_to=batch.shape[0])
+    finally:
+        for handle in handles:
+            handle.remove()
+    return state['peak'] + batch.numel() * batch.element_size()
+
+
+def _timed_forward(model, batch):
+    with torch.no_grad():
+        start = time.perf_counter()
+        model._forward(batch.cuda() if model.cuda else batch, pad_to=batch.shape[0])
+        if model.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter() - start
+
+
+def autotune(model, memory_mb, overlap=64, cache_path='./autotune_cache.json'):
+    """
+    Fastest (tile_size, batch_size) for predict_large_image whose activations fit in `memory_mb`.
+    Activation memory is measured once on a 256x256 tile and scaled with batch * tile area (fully convolutional
+    models), every fitting candidate is then timed on one forward pass. Speed is counted in output pixels per
+    second, i.e. only the (tile_size - overlap)^2 part of a tile that is not recomputed by its neighbours.
+    Results are cached in `cache_path` per (model, checkpoint, machine, budget).
+    """
+
+    key   = f"{model_id(model)}|{machine_id()}|{memory_mb}MB|{overlap}"
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    if key in cache:
+        print(f"Tile auto-tuning (cached): tile {cache[key]['tile_size']}, batch {cache[key]['batch_size']}")
+        return cache[key]
+
+    if model.session is not None or not isinstance(model.model, nn.Module) or isinstance(model.model, torch.jit.ScriptModule):
+        print("Tile auto-tuning needs an eager torch model, keeping tile 256.")
+        return {'tile_size': 256, 'batch_size': model.batch_size}
+
+    probe  = torch.randn(1, model.bands, 256, 256)
+    per_px = activation_peak_bytes(model, probe) * MEMORY_MARGIN / (256 * 256)
+    budget = memory_mb * 1024**2
+    tiles  = (256,) if model.model_type in FIXED_TILE_TYPES else TILE_CANDIDATES
+
+    print(f"{'tile':>6}{'batch':>7}{'est. MB':>9}{'Mpx/s':>8}")
+    best = None
+    for tile_size in tiles:
+        fitting = [n for n in BATCH_CANDIDATES if per_px * n * tile_size**2 <= budget]
+        if not fitting:
+            break
+        try:
+            _timed_forward(model, torch.randn(1, model.bands, tile_size, tile_size))      # warmup of the new shape
+            for n in fitting:
+                seconds = _timed_forward(model, torch.randn(n, model.bands, tile_size, tile_size))
+                speed   = n * (tile_size - overlap)**2 / seconds / 1e6
+                print(f"{tile_size:>6}{n:>7}{per_px*n*tile_size**2/1024**2:>9.0f}{speed:>8.2f}")
+                if best is None or speed > best['mpx_per_s']:
+                    best = {'tile_size': tile_size, 'batch_size': n, 'mpx_per_s': speed, 'est_mb': per_px*n*tile_size**2/1024**2}
+        except RuntimeError as e:
+            print(f"{tile_size:>6} not supported by {model.model_type}: {e}")
+            break
+
+    if best is None:
+        raise ValueError(f"memory budget {memory_mb}MB is too small for one {tiles[0]}x{tiles[0]} tile of {model.model_type}.")
+    print(f"Tile auto-tuning: tile {best['tile_size']}, batch {best['batch_size']} ({best['mpx_per_s']:.2f} Mpx/s)")
+
+    cache[key] = best
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    return best
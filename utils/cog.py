@@ -0,0 +1,80 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/08} ${14:25}
+# @Function: Cloud Optimized GeoTIFF writer for class rasters (internal tiles, compression, mode overviews)
+
+
+import os
+import time
+
+
+# Overview factors 2, 4, 8... until the smallest level fits in one block
+def overview_levels(width, height, blocksize=512):
+    levels, factor = [], 2
+    while max(width, height) / factor >= blocksize:
+        levels.append(factor)
+        factor *= 2
+    return levels or [2]
+
+
+class COGWriter:
+    """
+    Rows are written as they finish into a tiled temporary GTiff whose blocks are compressed by `threads` GDAL
+    worker threads. close() builds the overviews with MODE resampling (class values are never averaged, nodata
+    is excluded) and rewrites the file with the COG layout: overviews and tiles ordered for HTTP range reads.
+    """
+
+    def __init__(self, output_path, width, height, geotransform, projection, nodata=None, blocksize=512, compress='DEFLATE', threads='ALL_CPUS'):
+        import gdal
+
+        self.gdal        = gdal
+        self.output_path = output_path
+        self.tmp_path    = f"{os.path.splitext(output_path)[0]}.tmp.tif"
+        self.width       = width
+        self.height      = height
+        self.blocksize   = blocksize
+        self.compress    = compress
+        self.threads     = threads
+        self.start       = time.perf_counter()
+
+        options      = ['TILED=YES', f'BLOCKXSIZE={blocksize}', f'BLOCKYSIZE={blocksize}', 'COMPRESS=LZW',
+                        f'NUM_THREADS={threads}', 'BIGTIFF=IF_SAFER']
+        self.dataset = gdal.GetDriverByName('GTiff').Create(self.tmp_path, width, height, 1, gdal.GDT_Byte, options=options)
+        self.dataset.SetGeoTransform(geotransform)
+        self.dataset.SetProjection(projection)
+        self.band    = self.dataset.GetRasterBand(1)
+        if nodata is not None:
+            self.band.SetNoDataValue(nodata)
+
+    def write_rows(self, rows, yoff):
+        self.band.WriteArray(rows, 0, yoff)
+
+    # Whole prediction, written one row of blocks at a time
+    def write(self, prediction):
+        for yoff in range(0, self.height, self.blocksize):
+            self.write_rows(prediction[yoff:yoff+self.blocksize], yoff)
+
+    def close(self):
+        gdal = self.gdal
+        self.dataset.FlushCache()
+        self.band    = None
+        self.dataset = None
+
+        options = [f'COMPRESS={self.compress}', f'NUM_THREADS={self.threads}', 'BIGTIFF=IF_SAFER']
+        if gdal.GetDriverByName('COG') is not None:
+            gdal.Translate(self.output_path, self.tmp_path, format='COG',
+                           creationOptions=options + [f'BLOCKSIZE={self.blocksize}', 'OVERVIEW_RESAMPLING=MODE'])
+        else:
+            # GDAL < 3.1: overviews are built in the temporary file and copied ahead of the full resolution tiles
+            dataset = gdal.Open(self.tmp_path, gdal.GA_Update)
+            dataset.BuildOverviews('MODE', overview_levels(self.width, self.height, self.blocksize))
+            dataset = None
+            gdal.Translate(self.output_path, self.tmp_path, format='GTiff',
+                           creationOptions=options + ['TILED=YES', f'BLOCKXSIZE={self.blocksize}', f'BLOCKYSIZE={self.blocksize}', 'COPY_SRC_OVERVIEWS=YES'])
+        os.remove(self.tmp_path)
+
+        seconds = time.perf_counter() - self.start
+        size    = os.path.getsize(self.output_path)
+        print(f"COG written in {seconds:.2f}s, {size/1024**2:.2f}MB : {self.output_path}")
+        return {'seconds': seconds, 'bytes': size}
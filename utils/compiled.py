@@ -0,0 +1,66 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/30} ${11:05}
+# @Function: compiled forward graphs specialized per (tile shape, batch size) with an on-disk cache
+
+
+import os
+import time
+import torch
+
+
+COMPILE_MODES = ('torchscript', 'inductor')
+
+
+class CompiledForward:
+    """
+    Compiled versions of one network, one graph per input shape [N, C, H, W].
+    torchscript: frozen traced graphs saved as <cache_dir>/<tag>-NxCxHxW.ts.pt, reused while newer than the checkpoint
+    inductor   : torch.compile(dynamic=False), inductor's FX graph cache lives in cache_dir
+    """
+
+    def __init__(self, net, mode, cache_dir, tag, model_path):
+        if mode not in COMPILE_MODES:
+            raise NotImplementedError('compile mode [%s] is not implemented, torchscript/inductor is supported!' %mode)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.net        = net
+        self.mode       = mode
+        self.cache_dir  = cache_dir
+        self.tag        = tag
+        self.model_path = model_path
+        self.graphs     = {}
+        self.warmup     = {}
+
+        if mode == 'inductor':
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(cache_dir))
+            torch._inductor.config.fx_graph_cache = True
+            self.compiled = torch.compile(net, dynamic=False)
+
+    def cache_path(self, shape):
+        return os.path.join(self.cache_dir, f"{self.tag}-{'x'.join(str(s) for s in shape)}.ts.pt")
+
+    def _build(self, batch):
+        if self.mode == 'inductor':
+            return self.compiled
+
+        path = self.cache_path(tuple(batch.shape))
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(self.model_path):
+            return torch.jit.load(path, map_location=batch.device)
+        # pool workers may trace the same shape at once, the file only appears once it is complete
+        graph = torch.jit.freeze(torch.jit.trace(self.net, batch))
+        torch.jit.save(graph, f"{path}.{os.getpid()}.tmp")
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        return graph
+
+    def __call__(self, batch):
+        key = tuple(batch.shape)
+        if key not in self.graphs:
+            # warmup = load or trace/compile + the first (possibly optimizing) run
+            start            = time.perf_counter()
+            self.graphs[key] = self._build(batch)
+            output           = self.graphs[key](batch)
+            self.warmup[key] = time.perf_counter() - start
+            print(f"Compiled {self.mode} graph for input {list(key)} ready in {self.warmup[key]:.2f}s")
+            return output
+        return self.graphs[key](batch)
@@ -0,0 +1,113 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/22} ${16:40}
+# @Function: multi-process CPU tile prediction, workers share model weights, input image and accumulator
+
+
+import os
+import queue
+import numpy                 as np
+import torch
+import torch.multiprocessing as mp
+
+from utils.tiling import accumulate, TileBatcher
+
+
+# Split the usable cores into `workers` contiguous slices
+def core_slices(workers):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    step  = max(len(cores) // workers, 1)
+    return [cores[i*step:(i+1)*step] or cores[-step:] for i in range(workers)]
+
+
+def _worker(model, cores, threads, image, outputs, weights, lock, tasks, results, views, tile_size, batch_size):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    model._init_worker()
+
+    image   = image.numpy()
+    outputs = outputs.numpy()
+    weights = weights.numpy()
+    batcher = TileBatcher(image.shape[0], tile_size=tile_size, batch_size=batch_size)
+
+    while True:
+        chunk = tasks.get()
+        if chunk is None:
+            break
+        model.tta_views = views.value
+        tiles = ((image[:, x_start:x_end, y_start:y_end], (x_start, x_end, y_start, y_end, repeat))
+                 for x_start, x_end, y_start, y_end, repeat in chunk)
+        for batch, slots in batcher.batches(tiles):
+            predictions = model.predict_batch(batch)
+            with lock:
+                accumulate(outputs, weights, predictions, slots)
+        results.put((len(chunk), model.tta_views))
+    results.put(model.run_stats)
+
+
+# Statistics of all workers summed key by key
+def merge_stats(stats):
+    merged = {}
+    for worker_stats in stats:
+        for key, value in worker_stats.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def predict_tiles_in_pool(model, image, grid, tile_size, batch_size, workers, threads=None, on_chunk=None):
+    """
+    model    : Structure.Model, its weights are moved to shared memory once and read by every worker
+               (a frozen static int8 graph can not be shared, every worker loads it from the cache file)
+    grid     : tiles as (x_start, x_end, y_start, y_end, repeat), handed out through a queue in chunks of batch_size
+    on_chunk : called in this process as on_chunk(tiles, views) whenever a worker has finished a chunk, returns the
+               number of TTA views of the chunks handed out from then on (tta_budget)
+    return   : stitched (outputs, weights) accumulator and the run_stats of the workers summed
+    """
+
+    c, h, w = image.shape
+    slices  = core_slices(workers)
+    threads = threads or max(len(slices[0]), 1)
+    ctx     = mp.get_context('spawn')
+
+    if not isinstance(model.model, torch.jit.ScriptModule):
+        model.model.share_memory()
+    shared_image = torch.from_numpy(np.ascontiguousarray(image)).share_memory_()
+    outputs      = torch.zeros((h, w), dtype=torch.float64).share_memory_()
+    weights      = torch.zeros((h, w), dtype=torch.float32).share_memory_()
+    lock         = ctx.Lock()
+    tasks        = ctx.Queue()
+    results      = ctx.Queue()
+    views        = ctx.Value('i', model.tta_views)
+
+    for i in range(0, len(grid), batch_size):
+        tasks.put(grid[i:i+batch_size])
+    for _ in range(workers):
+        tasks.put(None)
+
+    procs = [ctx.Process(target=_worker, args=(model, cores, threads, shared_image, outputs, weights, lock, tasks, results, views, tile_size, batch_size))
+             for cores in slices]
+    for p in procs:
+        p.start()
+
+    # Workers report every finished chunk and end with their run_stats, a worker that died is noticed while waiting
+    stats = []
+    while len(stats) < workers:
+        try:
+            message = results.get(timeout=1)
+        except queue.Empty:
+            failed = [p.exitcode for p in procs if p.exitcode not in (None, 0)]
+            if failed:
+                for p in procs:
+                    p.terminate()
+                raise RuntimeError(f"inference worker exited with code {failed[0]}")
+            continue
+        if isinstance(message, dict):
+            stats.append(message)
+        elif on_chunk is not None:
+            views.value = on_chunk(*message)
+    for p in procs:
+        p.join()
+
+    return outputs.numpy(), weights.numpy(), merge_stats(stats)
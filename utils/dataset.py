@@ -6,18 +6,126 @@
 
 
 import os
+import collections
 import numpy as np
 import gdal
 import torch
 from torch.utils.data.dataset import Dataset
+from utils.shards import load_index
+from utils.labels import load_label_map, label_lut, remap_labels
 gdal.UseExceptions()
 
+
+class GDALHandleCache:
+    """
+    Open GDAL datasets of one process, the least recently used are closed beyond `max_handles`.
+    Handles are never shared: a copy in a forked or spawned DataLoader worker starts with an empty cache.
+    """
+
+    def __init__(self, max_handles=128):
+        self.max_handles = max_handles
+        self.handles     = collections.OrderedDict()
+        self.pid         = os.getpid()
+
+    def open(self, path):
+        if self.pid != os.getpid():
+            self.handles = collections.OrderedDict()
+            self.pid     = os.getpid()
+        if path in self.handles:
+            self.handles.move_to_end(path)
+            return self.handles[path]
+
+        dataset = gdal.Open(path)
+        self.handles[path] = dataset
+        if len(self.handles) > self.max_handles:
+            self.handles.popitem(last=False)
+        return dataset
+
+    def __getstate__(self):
+        return {'max_handles': self.max_handles, 'handles': collections.OrderedDict(), 'pid': None}
+
+
+class GDALBlockCache:
+    """
+    Windowed reads assembled from whole blocks of the raster's internal layout (tiles, or strips grouped to at
+    least `min_rows` rows). Decoded blocks, after `transform` (e.g. the label lookup table), are kept per process
+    and the least recently used are dropped beyond max_mb, so overlapping and neighbouring windows reuse reads.
+    """
+
+    def __init__(self, max_mb=256, max_handles=32, min_rows=64):
+        self.handles   = GDALHandleCache(max_handles)
+        self.max_bytes = max_mb * 1024**2
+        self.min_rows  = min_rows
+        self.layouts   = {}
+        self.reset()
+
+    def reset(self):
+        self.blocks = collections.OrderedDict()
+        self.nbytes = 0
+        self.pid    = os.getpid()
+
+    # (width, height, block width, block height) of a raster
+    def layout(self, path):
+        if path not in self.layouts:
+            dataset            = self.handles.open(path)
+            bw, bh             = dataset.GetRasterBand(1).GetBlockSize()
+            bh                 = bh * -(-self.min_rows // bh) if bh < self.min_rows else bh
+            self.layouts[path] = (dataset.RasterXSize, dataset.RasterYSize, bw, bh)
+        return self.layouts[path]
+
+    def block(self, path, bx, by, transform=None):
+        if self.pid != os.getpid():
+            self.reset()
+        key = (path, bx, by)
+        if key in self.blocks:
+            self.blocks.move_to_end(key)
+            return self.blocks[key]
+
+        width, height, bw, bh = self.layout(path)
+        xoff, yoff            = bx * bw, by * bh
+        block                 = self.handles.open(path).ReadAsArray(xoff, yoff, min(bw, width - xoff), min(bh, height - yoff))
+        block                 = transform(block) if transform is not None else block
+        self.blocks[key]      = block
+        self.nbytes          += block.nbytes
+        while self.nbytes > self.max_bytes and len(self.blocks) > 1:
+            self.nbytes -= self.blocks.popitem(last=False)[1].nbytes
+        return block
+
+    def read(self, path, xoff, yoff, xsize, ysize, transform=None):
+        _, _, bw, bh = self.layout(path)
+        window       = None
+        for by in range(yoff // bh, (yoff + ysize - 1) // bh + 1):
+            for bx in range(xoff // bw, (xoff + xsize - 1) // bw + 1):
+                block  = self.block(path, bx, by, transform)
+                x0, y0 = bx * bw, by * bh
+                x1, y1 = min(xoff + xsize, x0 + block.shape[-1]), min(yoff + ysize, y0 + block.shape[-2])
+                xs, ys = max(xoff, x0), max(yoff, y0)
+                if window is None:
+                    window = np.empty(block.shape[:-2] + (ysize, xsize), dtype=block.dtype)
+                window[..., ys-yoff:y1-yoff, xs-xoff:x1-xoff] = block[..., ys-y0:y1-y0, xs-x0:x1-x0]
+        return window
+
+    def __getstate__(self):
+        state           = self.__dict__.copy()
+        state['blocks'] = collections.OrderedDict()
+        state['nbytes'] = 0
+        state['pid']    = None
+        return state
+
+
 class Labeled_Model_Dataset(Dataset):
-    def __init__(self, annotation_lines, dataset_path):
+    """
+    Images in their source dtype, labels as uint8 classes: raster values are remapped through the lookup table of
+    `label_map` (default: <dataset_path>/label_map.json or utils.labels.DEFAULT_LABEL_MAP).
+    """
+
+    def __init__(self, annotation_lines, dataset_path, max_handles=128, label_map=None):
         super(Labeled_Model_Dataset, self).__init__()
         self.annotation_lines = annotation_lines
         self.length           = len(annotation_lines)
         self.dataset_path     = dataset_path
+        self.handles          = GDALHandleCache(max_handles)
+        self.label_lut        = label_lut(label_map or load_label_map(dataset_path))
 
     def __len__(self):
         return self.length
@@ -25,13 +133,100 @@ class Labeled_Model_Dataset(Dataset):
     def __getitem__(self, index):
         annotation_line   = self.annotation_lines[index]
         name              = annotation_line.split()[0]
-        image             = gdal.Open(os.path.join(os.path.join(self.dataset_path, "images"), name + ".tif")).ReadAsArray().astype(np.float32)
-        image             = np.nan_to_num(image, nan=0.0)
-        label             = gdal.Open(os.path.join(os.path.join(self.dataset_path, "labels"), name + ".tif")).ReadAsArray()
-        label[label==128] = 1
-        label[label==255] = 2
+        image             = self.handles.open(os.path.join(self.dataset_path, "images", name + ".tif")).ReadAsArray()
+        label             = self.handles.open(os.path.join(self.dataset_path, "labels", name + ".tif")).ReadAsArray()
+        return image, remap_labels(label, self.label_lut)
+
+class Scene_Crop_Dataset(Dataset):
+    """
+    Random crop_size windows of whole scenes, images/<name>.tif and labels/<name>.tif of the annotation lines, read
+    through a GDALBlockCache instead of pre-cut tiles. An epoch holds samples_per_scene crops of every scene (sample
+    i belongs to scene i // samples_per_scene). Without seed the windows come from the torch generator of the
+    loading process and change every epoch; with seed, window i is fixed (validation).
+    """
+
+    def __init__(self, annotation_lines, dataset_path, crop_size=256, samples_per_scene=64, seed=None, block_cache_mb=256, max_handles=32, label_map=None):
+        super(Scene_Crop_Dataset, self).__init__()
+        self.names             = [line.split()[0] for line in annotation_lines if line.strip()]
+        self.dataset_path      = dataset_path
+        self.crop_size         = crop_size
+        self.samples_per_scene = samples_per_scene
+        self.seed              = seed
+        self.length            = len(self.names) * samples_per_scene
+        self.blocks            = GDALBlockCache(block_cache_mb, max_handles)
+        self.label_lut         = label_lut(label_map or load_label_map(dataset_path))
+        self.sizes             = []
+        for name in self.names:
+            width, height = self.blocks.layout(self.path("images", name))[:2]
+            if width < crop_size or height < crop_size:
+                raise ValueError(f"scene {name} ({width}x{height}) is smaller than crop size {crop_size}.")
+            self.sizes.append((width, height))
+
+    def path(self, kind, name):
+        return os.path.join(self.dataset_path, kind, name + ".tif")
+
+    def __len__(self):
+        return self.length
+
+    def remap(self, label):
+        return remap_labels(label, self.label_lut)
+
+    def __getitem__(self, index):
+        scene         = index // self.samples_per_scene
+        name          = self.names[scene]
+        width, height = self.sizes[scene]
+        if self.seed is None:
+            xoff = int(torch.randint(width  - self.crop_size + 1, (1,)))
+            yoff = int(torch.randint(height - self.crop_size + 1, (1,)))
+        else:
+            rng  = np.random.default_rng((self.seed, index))
+            xoff = int(rng.integers(width  - self.crop_size + 1))
+            yoff = int(rng.integers(height - self.crop_size + 1))
+        image = self.blocks.read(self.path("images", name), xoff, yoff, self.crop_size, self.crop_size)
+        label = self.blocks.read(self.path("labels", name), xoff, yoff, self.crop_size, self.crop_size, self.remap)
         return image, label
 
+class Labeled_Shard_Dataset(Dataset):
+    """
+    Samples of a split packed by build_shards.py. Images and labels are views into the memory-mapped shards,
+    already converted and remapped at build time, so nothing is decoded or copied per sample. Shards are mapped
+    copy-on-write the first time a process reads them (maps are not pickled to DataLoader workers).
+    """
+
+    def __init__(self, shard_dir, split):
+        super(Labeled_Shard_Dataset, self).__init__()
+        self.meta, self.index = load_index(shard_dir, split)
+        self.shard_dir        = shard_dir
+        self.image_dtype      = np.dtype(self.meta['image_dtype'])
+        self.label_dtype      = np.dtype(self.meta['label_dtype'])
+        self.length           = len(self.index)
+        self.maps             = {}
+        self.pid              = os.getpid()
+
+    def __len__(self):
+        return self.length
+
+    def shard(self, k):
+        if self.pid != os.getpid():
+            self.maps = {}
+            self.pid  = os.getpid()
+        if k not in self.maps:
+            self.maps[k] = np.memmap(os.path.join(self.shard_dir, self.meta['shards'][k]), dtype=np.uint8, mode='c')
+        return self.maps[k]
+
+    def __getitem__(self, index):
+        shard, image_offset, label_offset, bands, height, width = self.index[index].tolist()
+        data  = self.shard(shard)
+        image = data[image_offset:image_offset + bands*height*width*self.image_dtype.itemsize].view(self.image_dtype)
+        label = data[label_offset:label_offset + height*width*self.label_dtype.itemsize].view(self.label_dtype)
+        return image.reshape(bands, height, width), label.reshape(height, width)
+
+    def __getstate__(self):
+        state         = self.__dict__.copy()
+        state['maps'] = {}
+        state['pid']  = None
+        return state
+
 class UnLabeled_Model_Dataset(Dataset):
     def __init__(self, annotation_lines, dataset_path):
         super(UnLabeled_Model_Dataset, self).__init__()
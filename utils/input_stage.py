@@ -0,0 +1,24 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/18} ${09:40}
+# @Function: model input stage, imagery stays in its source dtype (e.g. uint16) until it is on the model device
+
+
+import torch
+
+
+def to_model_input(batch, scale=None, nan=None):
+    """
+    batch : [N, C, H, W] tensor in the source dtype, already moved to the model device
+    scale : factor applied after the float32 conversion (e.g. 1e-4 for Sentinel-2 L2A reflectance), None keeps raw values
+    nan   : value replacing NaN of floating point sources, None leaves them
+    """
+    floating = batch.is_floating_point()
+    batch    = batch.float()
+    if nan is not None and floating:
+        batch = torch.nan_to_num(batch, nan=nan)
+    if scale is not None:
+        batch = batch * scale
+    return batch
+
@@ -0,0 +1,43 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/19} ${11:20}
+# @Function: per-dataset label value remapping through a uint8 lookup table
+
+
+import os
+import json
+import numpy as np
+
+
+DEFAULT_LABEL_MAP = {128: 1, 255: 2}        # label rasters of ./datasets: 0 background, 128 / 255 the two target classes
+
+
+def load_label_map(dataset_path, path=None):
+    """
+    Raster value -> class of a dataset, from `path` or <dataset_path>/label_map.json, e.g. {"128": 1, "255": 2}.
+    Values that are not listed keep their value. Without a file DEFAULT_LABEL_MAP is used.
+    """
+    path = path or os.path.join(dataset_path, "label_map.json")
+    if not os.path.isfile(path):
+        return dict(DEFAULT_LABEL_MAP)
+    with open(path, 'r') as f:
+        return {int(value): int(cls) for value, cls in json.load(f).items()}
+
+
+def label_lut(label_map):
+    lut = np.arange(256, dtype=np.uint8)
+    for value, cls in label_map.items():
+        if not (0 <= value < 256 and 0 <= cls < 256):
+            raise ValueError(f"label map {value} -> {cls} is out of the uint8 range.")
+        lut[value] = cls
+    return lut
+
+
+# One gather through the table, labels come out as uint8 whatever integer dtype the raster has
+def remap_labels(label, lut):
+    if label.dtype != np.uint8:
+        if label.size and (label.min() < 0 or label.max() > 255):
+            raise ValueError(f"label values {label.min()}..{label.max()} do not fit in uint8.")
+        label = label.astype(np.uint8)
+    return lut[label]
@@ -0,0 +1,107 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/04} ${10:20}
+# @Function: pool of loaded Structure.Model checkpoints with least recently used eviction
+
+
+import os
+import threading
+import collections
+import torch
+
+
+PoolEntry = collections.namedtuple('PoolEntry', ['model', 'nbytes', 'mtime'])
+
+
+# Resident size of a loaded Structure.Model: parameters + buffers, or the .onnx file for an ONNX Runtime session
+def model_bytes(model):
+    if model.session is not None:
+        return os.path.getsize(os.path.splitext(model.model_path)[0] + '.onnx')
+    tensors = list(model.model.parameters()) + list(model.model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelPool:
+    """
+    Lazily loaded models keyed by (model_type, backbone, checkpoint path, get() kwargs).
+    At most `max_models` stay resident and their total size stays under `memory_mb`, the least recently used are evicted.
+    A model is rebuilt when its checkpoint file changes on disk (or on reload), the new one replaces the entry
+    atomically. Callers that already got the old model keep their reference, so requests in flight finish on it.
+    model_kwargs are passed to every Structure.Model, get() kwargs override them: the same checkpoint requested
+    with other kwargs (e.g. precision='bf16') is a separate entry.
+    """
+
+    def __init__(self, max_models=3, memory_mb=None, **model_kwargs):
+        self.max_models   = max_models
+        self.memory_mb    = memory_mb
+        self.model_kwargs = model_kwargs
+        self.models       = collections.OrderedDict()
+        self.lock         = threading.Lock()
+        self.key_locks    = {}
+        self.stats        = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def _load(self, key, kwargs):
+        from Structure import Model
+
+        model_type, backbone, model_path, _ = key
+        mtime = os.path.getmtime(model_path)
+        model = Model(model_path=model_path, model_type=model_type, backbone=backbone, **{**self.model_kwargs, **kwargs})
+        entry = PoolEntry(model, model_bytes(model), mtime)
+        print(f"Model pool: loaded {model_type}/{backbone} from {model_path} ({entry.nbytes/2**20:.1f} MB)")
+        return entry
+
+    def _evict(self):
+        budget = self.memory_mb * 2**20 if self.memory_mb else float('inf')
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.resident_bytes() > budget):
+            key, _ = self.models.popitem(last=False)
+            self.stats['evictions'] += 1
+            print(f"Model pool: evicted {key[0]}/{key[1]} ({key[2]})")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def resident_bytes(self):
+        return sum(entry.nbytes for entry in self.models.values())
+
+    @staticmethod
+    def key(model_type, backbone, model_path, kwargs):
+        return (model_type, backbone, os.path.abspath(model_path), tuple(sorted(kwargs.items())))
+
+    def get(self, model_type, backbone, model_path, **kwargs):
+        key = self.key(model_type, backbone, model_path, kwargs)
+        # Only one thread loads a given key, the others wait for it. Other keys are served meanwhile.
+        with self._key_lock(key):
+            with self.lock:
+                entry = self.models.get(key)
+                if entry is not None and entry.mtime == os.path.getmtime(key[2]):
+                    self.models.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry.model
+
+            entry = self._load(key, kwargs)
+            with self.lock:
+                self.models[key] = entry
+                self.models.move_to_end(key)
+                self.stats['loads'] += 1
+                self._evict()
+        return entry.model
+
+    # Hot-swap: rebuild the model from its (updated) checkpoint even if the file time did not change
+    def reload(self, model_type, backbone, model_path, **kwargs):
+        key = self.key(model_type, backbone, model_path, kwargs)
+        with self._key_lock(key):
+            entry = self._load(key, kwargs)
+            with self.lock:
+                self.models[key] = entry
+                self.models.move_to_end(key)
+                self.stats['loads'] += 1
+                self._evict()
+        return entry.model
+
+    def keys(self):
+        with self.lock:
+            return list(self.models)
@@ -0,0 +1,33 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/28} ${16:30}
+# @Function: ONNX Runtime inference session for exported models
+
+
+import os
+
+
+# Exported .onnx file that belongs to a .pth checkpoint
+def onnx_path_for(model_path):
+    return model_path if model_path.endswith('.onnx') else os.path.splitext(model_path)[0] + '.onnx'
+
+
+def create_session(onnx_path, threads=0, use_cuda=False):
+    """ORT session with all graph optimizations, `threads`=0 lets ORT pick the intra-op thread count"""
+
+    import onnxruntime as ort
+
+    if not os.path.isfile(onnx_path):
+        raise FileNotFoundError(f"No ONNX model in {onnx_path}, run export_onnx.py first.")
+
+    options                          = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode           = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads     = threads
+    options.inter_op_num_threads     = 1
+
+    providers = ['CPUExecutionProvider']
+    if use_cuda and 'CUDAExecutionProvider' in ort.get_available_providers():
+        providers.insert(0, 'CUDAExecutionProvider')
+    return ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
@@ -0,0 +1,59 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/24} ${09:30}
+# @Function: reduced precision (bfloat16/float16) inference with numerically sensitive layers kept in float32
+
+
+import contextlib
+import torch
+import torch.nn as nn
+
+
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+# Softmax (e.g. the Swin window attention) and normalization statistics lose too much in 8-bit mantissas
+SENSITIVE_LAYERS = (nn.Softmax, nn.modules.batchnorm._BatchNorm, nn.LayerNorm, nn.GroupNorm)
+
+
+class Float32Layer(nn.Module):
+    """Run the wrapped layer in float32 outside autocast, cast the result back to the input dtype"""
+
+    def __init__(self, layer):
+        super(Float32Layer, self).__init__()
+        self.layer = layer.float()
+
+    def forward(self, x):
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            return self.layer(x.float()).to(x.dtype)
+
+
+# Wrap every sensitive layer of the model in Float32Layer (in place), returns the number of wrapped layers
+def keep_sensitive_float32(model):
+    count = 0
+    for name, child in model.named_children():
+        if isinstance(child, SENSITIVE_LAYERS):
+            setattr(model, name, Float32Layer(child))
+            count += 1
+        elif not isinstance(child, Float32Layer):
+            count += keep_sensitive_float32(child)
+    return count
+
+
+# Cast mode: parameters and float buffers in reduced precision, layers wrapped in Float32Layer are left untouched
+def cast_model(model, dtype):
+    for child in model.children():
+        if not isinstance(child, Float32Layer):
+            cast_model(child, dtype)
+    for param in model.parameters(recurse=False):
+        param.data = param.data.to(dtype)
+    for name, buf in model.named_buffers(recurse=False):
+        if buf.is_floating_point():
+            model._buffers[name] = buf.to(dtype)
+    return model
+
+
+def autocast_context(device_type, precision, autocast=True):
+    if precision == 'fp32' or not autocast:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device_type, dtype=PRECISIONS[precision])
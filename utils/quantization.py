@@ -0,0 +1,92 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/25} ${14:10}
+# @Function: int8 quantized inference models and their on-disk cache next to the .pth weights
+
+
+import os
+import torch
+import torch.fx                 as fx
+import torch.nn                 as nn
+import torch.nn.functional      as F
+from torch.ao.quantization             import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+# Transformer-heavy models whose CPU time is dominated by nn.Linear (Swin qkv/proj/Mlp, SETR TransformerBlock, Segformer q/kv)
+DYNAMIC_QUANT_TYPES = ('upernet', 'setr', 'segformer', 'mask2former')
+
+# Convolution-bound models, Conv+BN+ReLU is fused and quantized statically after calibration (nets/ENet.py can not be built, it is left out)
+STATIC_QUANT_TYPES  = ('unet', 'deeplab', 'pspnet', 'segnet')
+
+
+def quantized_cache_path(model_path, kind):
+    return f"{os.path.splitext(model_path)[0]}.{kind}_int8.pt"
+
+
+# Dynamic int8: Linear weights are quantized ahead of time, activations per batch at runtime
+def dynamic_quantize(model):
+    model = quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+    count = sum(1 for m in model.modules() if isinstance(m, torch.ao.nn.quantized.dynamic.Linear))
+    print(f"Dynamic int8 quantization: {count} Linear layers quantized.")
+    return model
+
+
+class InlineTracer(fx.Tracer):
+    """FX tracer that traces through modules created inside forward (e.g. `self.features[:3]` slices) instead of failing"""
+
+    def call_module(self, m, forward, args, kwargs):
+        try:
+            self.path_of_module(m)
+        except NameError:
+            return forward(*args, **kwargs)
+        return super().call_module(m, forward, args, kwargs)
+
+
+# Max pooling with indices and unpooling have no int8 kernels, they stay float between dequant/quant
+def static_qconfig_mapping(backend='x86'):
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for op in (nn.MaxPool2d, nn.MaxUnpool2d, F.max_pool2d, F.max_unpool2d):
+        qconfig_mapping = qconfig_mapping.set_object_type(op, None)
+    return qconfig_mapping
+
+
+def static_quantize(model, calib_batches, backend='x86'):
+    """
+    Graph-mode static int8 quantization. prepare_fx fuses Conv+BN(+ReLU) and inserts observers,
+    the observers are calibrated on `calib_batches` (list of [N, C, H, W] float tensors) before conversion.
+    The converted graph is returned as a TorchScript module so that it can be saved and loaded without the nets code.
+    """
+
+    torch.backends.quantized.engine = backend
+    model    = model.eval().cpu()
+    graph    = fx.GraphModule(model, InlineTracer().trace(model))
+    prepared = prepare_fx(graph, static_qconfig_mapping(backend), example_inputs=(calib_batches[0],))
+
+    with torch.no_grad():
+        for batch in calib_batches:
+            prepared(batch)
+        return torch.jit.freeze(torch.jit.trace(convert_fx(prepared), calib_batches[0]))
+
+
+def load_cached_quantized(model_path, kind):
+    """Quantized model cached for `model_path`, None if missing or older than the float weights"""
+
+    cache_path = quantized_cache_path(model_path, kind)
+    if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(model_path):
+        print(f"Loading cached {kind} int8 model from {cache_path}")
+        if kind == 'static':
+            return torch.jit.load(cache_path, map_location='cpu').eval()
+        return torch.load(cache_path, map_location='cpu', weights_only=False).eval()
+    return None
+
+
+def save_cached_quantized(model, model_path, kind):
+    cache_path = quantized_cache_path(model_path, kind)
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, cache_path)
+    else:
+        torch.save(model, cache_path)
+    print(f"Quantized model cached in : {cache_path}")
+    return cache_path
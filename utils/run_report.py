@@ -0,0 +1,81 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/12} ${10:35}
+# @Function: per-stage wall time, bytes, item counts and peak RSS of an inference job, saved as a JSON report
+
+
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:                 # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == 'darwin' else rss / 1024          # bytes on macOS, KB on Linux
+
+
+class RunReport:
+    """
+    Stages of one job, e.g. read / batching / forward / stitch / write / polygonize, each with wall seconds, calls,
+    bytes read and written, items (tiles, features...) and the process peak RSS seen when the stage last ran.
+    progress(done, total) is called with the number of finished tiles if a callback is given.
+    """
+
+    def __init__(self, progress=None, **meta):
+        self.meta        = meta
+        self.stages      = {}
+        self.stats       = {}
+        self.progress_fn = progress
+        self.start       = time.perf_counter()
+
+    def add(self, name, seconds=0.0, bytes_read=0, bytes_written=0, items=0):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes_read': 0, 'bytes_written': 0, 'items': 0, 'peak_rss_mb': 0.0})
+        entry['seconds']       += seconds
+        entry['calls']         += 1
+        entry['bytes_read']    += bytes_read
+        entry['bytes_written'] += bytes_written
+        entry['items']         += items
+        entry['peak_rss_mb']    = max(entry['peak_rss_mb'], peak_rss_mb())
+
+    @contextlib.contextmanager
+    def stage(self, name, bytes_read=0, bytes_written=0, items=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, bytes_read, bytes_written, items)
+
+    # Time spent producing every item of `iterable` (e.g. a generator doing the work lazily) is booked on `name`
+    def timed_iter(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def progress(self, done, total):
+        if self.progress_fn is not None:
+            self.progress_fn(done, total)
+
+    def as_dict(self):
+        return {'meta': self.meta, 'wall_s': time.perf_counter() - self.start, 'peak_rss_mb': peak_rss_mb(),
+                'stages': self.stages, 'stats': self.stats}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, default=str)
+        print(f"Run report saved in : {path}")
@@ -0,0 +1,237 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/02} ${20:10}
+# @Function: dynamic micro-batching and HTTP handler of the local inference server
+
+
+import io
+import os
+import json
+import time
+import queue
+import threading
+import collections
+import numpy as np
+import torch
+
+from http.server  import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+class PendingRequest:
+    def __init__(self, patch):
+        self.patch   = patch
+        self.done    = threading.Event()
+        self.result  = None
+        self.error   = None
+        self.arrived = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Merge concurrent requests into micro-batches for one loaded Structure.Model.
+    A batch is closed when it holds `max_batch` patches or `max_latency_ms` after its first patch arrived.
+    Patches of the same shape share a forward pass, patches larger than `tile_size` go through predict_large_image.
+    With `get_model` (e.g. a utils.model_pool.ModelPool lookup) the model is fetched again for every batch,
+    so pool evictions and checkpoint hot-swaps are picked up.
+    """
+
+    def __init__(self, model=None, max_batch=8, max_latency_ms=20, tile_size=256, get_model=None):
+        self.get_model  = get_model or (lambda: model)
+        self.max_batch  = max_batch
+        self.max_wait   = max_latency_ms / 1000.0
+        self.tile_size  = tile_size
+        self.requests   = queue.Queue()
+        self.latencies  = collections.deque(maxlen=2048)
+        self.batches    = collections.deque(maxlen=2048)
+        self.served     = 0
+        self.thread     = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, patch, timeout=None):
+        request = PendingRequest(patch)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("prediction timed out")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def depth(self):
+        return self.requests.qsize()
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        stats     = {'served': self.served, 'queue_depth': self.depth(),
+                     'mean_batch': float(np.mean(self.batches)) if self.batches else 0.0}
+        for p in (50, 90, 99):
+            stats[f'p{p}_ms'] = float(np.percentile(latencies, p)) if len(latencies) else 0.0
+        return stats
+
+    def _collect(self):
+        batch    = [self.requests.get()]
+        deadline = batch[0].arrived + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch  = self._collect()
+            groups = collections.defaultdict(list)
+            for request in batch:
+                groups[request.patch.shape + (request.patch.dtype,)].append(request)
+
+            for shape, requests in groups.items():
+                try:
+                    model = self.get_model()
+                    if shape[1] > self.tile_size or shape[2] > self.tile_size:
+                        for request in requests:
+                            request.result = model.predict_large_image(request.patch, tile_size=self.tile_size)
+                    else:
+                        stacked = torch.from_numpy(np.stack([request.patch for request in requests]))
+                        for request, result in zip(requests, model.predict_batch(stacked)):
+                            request.result = result.astype(np.uint8)
+                except Exception as e:
+                    for request in requests:
+                        request.error = e
+                self.batches.append(len(requests))
+
+            for request in batch:
+                self.latencies.append(time.perf_counter() - request.arrived)
+                self.served += 1
+                request.done.set()
+
+
+# GeoTIFF bytes -> ([C, H, W] in the source dtype, geotransform, projection)
+def decode_geotiff(data):
+    import gdal
+
+    path    = f"/vsimem/request_{threading.get_ident()}.tif"
+    gdal.FileFromMemBuffer(path, data)
+    try:
+        dataset = gdal.Open(path)
+        image   = dataset.ReadAsArray()
+        geo     = (dataset.GetGeoTransform(), dataset.GetProjection())
+        dataset = None
+    finally:
+        gdal.Unlink(path)
+    return (image[np.newaxis] if image.ndim == 2 else image), geo
+
+
+def encode_geotiff(prediction, geo):
+    import gdal
+
+    path    = f"/vsimem/response_{threading.get_ident()}.tif"
+    dataset = gdal.GetDriverByName('GTiff').Create(path, prediction.shape[1], prediction.shape[0], 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform(geo[0])
+    dataset.SetProjection(geo[1])
+    dataset.GetRasterBand(1).WriteArray(prediction)
+    dataset = None
+    try:
+        handle = gdal.VSIFOpenL(path, 'rb')
+        gdal.VSIFSeekL(handle, 0, 2)
+        size   = gdal.VSIFTellL(handle)
+        gdal.VSIFSeekL(handle, 0, 0)
+        data   = gdal.VSIFReadL(1, size, handle)
+        gdal.VSIFCloseL(handle)
+    finally:
+        gdal.Unlink(path)
+    return data
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with a .npy [C, H, W] or GeoTIFF body, GET /health, /queue and /stats.
+    With a model pool, POST /predict?checkpoint=<file>.pth runs another checkpoint of `model_dir` (same
+    architecture), every checkpoint gets its own MicroBatcher built by `make_batcher(path)`.
+    """
+
+    batcher      = None
+    model_info   = {}
+    model_dir    = None
+    make_batcher = None
+    checkpoints  = {}
+    lock         = threading.Lock()
+
+    # MicroBatcher of the requested checkpoint, None if it is not a .pth file of model_dir
+    @classmethod
+    def batcher_for(cls, name):
+        if name is None:
+            return cls.batcher
+        path = os.path.join(cls.model_dir or '', name)
+        if cls.make_batcher is None or os.path.basename(name) != name or not name.endswith('.pth') or not os.path.isfile(path):
+            return None
+        with cls.lock:
+            if name not in cls.checkpoints:
+                cls.checkpoints[name] = cls.make_batcher(path)
+            return cls.checkpoints[name]
+
+    def _send(self, code, body, content_type='application/json'):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, dict(status='ok', **self.model_info))
+        elif self.path == '/queue':
+            self._send(200, {'queue_depth': self.batcher.depth()})
+        elif self.path == '/stats':
+            stats = self.batcher.stats()
+            if self.checkpoints:
+                stats['checkpoints'] = {name: batcher.stats() for name, batcher in list(self.checkpoints.items())}
+            self._send(200, stats)
+        else:
+            self._send(404, {'error': f'unknown endpoint {self.path}'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/predict':
+            self._send(404, {'error': f'unknown endpoint {self.path}'})
+            return
+
+        data       = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        checkpoint = parse_qs(url.query).get('checkpoint', [None])[0]
+        batcher    = self.batcher_for(checkpoint)
+        if batcher is None:
+            self._send(404, {'error': f'unknown checkpoint {checkpoint}'})
+            return
+
+        try:
+            if data[:6] == b'\x93NUMPY':
+                patch, geo = np.load(io.BytesIO(data), allow_pickle=False), None
+            else:
+                patch, geo = decode_geotiff(data)
+            if patch.ndim != 3:
+                raise ValueError(f"patch dimension show be [C, H, W], but get {patch.shape} instead.")
+        except Exception as e:
+            self._send(400, {'error': f'can not decode patch: {e}'})
+            return
+
+        try:
+            prediction = batcher.submit(np.ascontiguousarray(patch))
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+
+        if geo is not None:
+            self._send(200, encode_geotiff(prediction, geo), 'image/tiff')
+        else:
+            buffer = io.BytesIO()
+            np.save(buffer, prediction)
+            self._send(200, buffer.getvalue(), 'application/x-npy')
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,120 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/16} ${15:05}
+# @Function: packed binary training shards (images/labels decoded and preprocessed once) with an offset index
+
+
+import os
+import json
+import numpy as np
+
+from utils.labels import load_label_map, label_lut, remap_labels
+
+
+ALIGN       = 64                    # sample records start on cache line boundaries, views of any dtype stay aligned
+INDEX_DTYPE = np.dtype([('shard', np.int32), ('image_offset', np.int64), ('label_offset', np.int64),
+                        ('bands', np.int32), ('height', np.int32), ('width', np.int32)])
+
+
+def shard_paths(shard_dir, split):
+    return os.path.join(shard_dir, f"{split}.json"), os.path.join(shard_dir, f"{split}_index.npy")
+
+
+class ShardWriter:
+    """
+    Samples appended to <split>_<k>.bin files of about shard_mb each: image bytes then label bytes, every record
+    padded to ALIGN. The index (shard, offsets, shape per sample) is saved as <split>_index.npy, dtypes and names
+    in <split>.json, so a reader maps a shard once and slices samples out of it without copying.
+    """
+
+    def __init__(self, shard_dir, split, shard_mb=1024, label_map=None):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir   = shard_dir
+        self.split       = split
+        self.shard_bytes = shard_mb * 1024**2
+        self.label_map   = label_map or {}
+        self.entries     = []
+        self.names       = []
+        self.dtypes      = None
+        self.shard       = -1
+        self.file        = None
+        self.offset      = 0
+
+    def shard_name(self, shard):
+        return f"{self.split}_{shard}.bin"
+
+    def next_shard(self):
+        if self.file is not None:
+            self.file.close()
+        self.shard += 1
+        self.file   = open(os.path.join(self.shard_dir, self.shard_name(self.shard)), 'wb')
+        self.offset = 0
+
+    def write_array(self, array):
+        offset = self.offset
+        data   = np.ascontiguousarray(array).tobytes()
+        pad    = -len(data) % ALIGN
+        self.file.write(data + b'\0' * pad)
+        self.offset += len(data) + pad
+        return offset
+
+    def add(self, name, image, label):
+        dtypes = (image.dtype.str, label.dtype.str)
+        if self.dtypes is None:
+            self.dtypes = dtypes
+        elif dtypes != self.dtypes:
+            raise ValueError(f"sample {name}: dtypes {dtypes} differ from {self.dtypes} of the first sample")
+        if image.ndim == 2:
+            image = image[None]
+
+        if self.file is None or (self.offset and self.shard_bytes and self.offset + image.nbytes + label.nbytes > self.shard_bytes):
+            self.next_shard()
+        image_offset = self.write_array(image)
+        label_offset = self.write_array(label)
+        self.entries.append((self.shard, image_offset, label_offset) + image.shape)
+        self.names.append(name)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        meta_path, index_path = shard_paths(self.shard_dir, self.split)
+        np.save(index_path, np.array(self.entries, dtype=INDEX_DTYPE))
+        with open(meta_path, 'w') as f:
+            json.dump({'image_dtype': self.dtypes[0] if self.dtypes else '<f4',
+                       'label_dtype': self.dtypes[1] if self.dtypes else '|u1',
+                       'shards': [self.shard_name(k) for k in range(self.shard + 1)],
+                       'label_map': {str(value): cls for value, cls in self.label_map.items()},
+                       'names': self.names}, f)
+        return len(self.entries)
+
+
+# Decode every sample of annotations/<split>.txt under dataset_path into shards under shard_dir. Images keep their
+# source dtype (NaN are replaced by the model input stage on the device), labels are remapped to uint8 classes.
+def build_shards(dataset_path, shard_dir, split, shard_mb=1024, log_every=1000, label_map=None):
+    import gdal
+
+    with open(os.path.join(dataset_path, "annotations", f"{split}.txt"), "r") as f:
+        names = [line.split()[0] for line in f if line.strip()]
+
+    label_map = label_map or load_label_map(dataset_path)
+    lut       = label_lut(label_map)
+    writer    = ShardWriter(shard_dir, split, shard_mb, label_map)
+    for i, name in enumerate(names, 1):
+        image = gdal.Open(os.path.join(dataset_path, "images", name + ".tif")).ReadAsArray()
+        label = gdal.Open(os.path.join(dataset_path, "labels", name + ".tif")).ReadAsArray()
+        writer.add(name, image, remap_labels(label, lut))
+        if i % log_every == 0:
+            print(f"{split}: {i}/{len(names)} samples packed")
+    count = writer.close()
+
+    size = sum(os.path.getsize(os.path.join(shard_dir, writer.shard_name(k))) for k in range(writer.shard + 1))
+    print(f"{split}: {count} samples in {writer.shard + 1} shard(s), {size/1024**2:.1f}MB : {shard_dir}")
+    return count
+
+
+def load_index(shard_dir, split):
+    meta_path, index_path = shard_paths(shard_dir, split)
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return meta, np.load(index_path)
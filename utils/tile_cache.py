@@ -0,0 +1,115 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/10} ${16:50}
+# @Function: content-addressed on-disk cache of tile predictions with size-bounded LRU eviction
+
+
+import os
+import time
+import hashlib
+import numpy as np
+
+
+class TileCache:
+    """
+    Per-tile class maps stored as compressed .npz under cache_dir/<2 hex>/<key>.npz, together with the seconds the
+    tile took to predict. Keys hash the model fingerprint, the tile content and its geometry (tile and padded
+    batch shape, dtype), so a tile is found again wherever it lies in whichever scene. Hits refresh the file time,
+    when the cache grows over max_mb the least recently used files are removed down to 90% of it.
+    """
+
+    digests = {}
+
+    def __init__(self, cache_dir, max_mb=2048):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024**2
+        self.index     = {}
+        for sub in os.scandir(cache_dir):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    stat                   = entry.stat()
+                    self.index[entry.path] = (stat.st_mtime, stat.st_size)
+        self.total     = sum(size for _, size in self.index.values())
+        self.start_job()
+
+    # Checkpoint file hash, computed once per (path, mtime)
+    @classmethod
+    def file_digest(cls, path):
+        stamp = (os.path.abspath(path), os.path.getmtime(path))
+        if stamp not in cls.digests:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            cls.digests[stamp] = digest.hexdigest()
+        return cls.digests[stamp]
+
+    @staticmethod
+    def key(model_id, patch, padded_shape):
+        digest = hashlib.blake2b(model_id.encode(), digest_size=20)
+        digest.update(f"{patch.shape}|{padded_shape}|{patch.dtype}".encode())
+        digest.update(np.ascontiguousarray(patch).data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def start_job(self):
+        self.stats = {'lookups': 0, 'hits': 0, 'saved_s': 0.0, 'lookup_s': 0.0}
+
+    def get(self, key):
+        start = time.perf_counter()
+        path  = self.path(key)
+        self.stats['lookups'] += 1
+        if path not in self.index:
+            self.stats['lookup_s'] += time.perf_counter() - start
+            return None
+
+        try:
+            with np.load(path) as data:
+                prediction, seconds = data['p'], float(data['s'])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # removed by another process or partially written
+            self.total -= self.index.pop(path)[1]
+            self.stats['lookup_s'] += time.perf_counter() - start
+            return None
+
+        self.index[path]        = (time.time(), self.index[path][1])
+        self.stats['hits']     += 1
+        self.stats['saved_s']  += seconds
+        self.stats['lookup_s'] += time.perf_counter() - start
+        return prediction
+
+    def put(self, key, prediction, seconds):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp  = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, p=prediction.astype(np.uint8), s=seconds)
+        os.replace(tmp, path)
+
+        size = os.path.getsize(path)
+        self.total      += size - self.index.get(path, (0, 0))[1]
+        self.index[path] = (time.time(), size)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        for path, (_, size) in sorted(self.index.items(), key=lambda item: item[1][0]):
+            if self.total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total -= size
+            del self.index[path]
+
+    def report(self):
+        stats = self.stats
+        if stats['lookups']:
+            print(f"Tile cache: {stats['hits']}/{stats['lookups']} hits ({stats['hits']/stats['lookups']:.1%}), "
+                  f"~{max(stats['saved_s'] - stats['lookup_s'], 0):.2f}s saved, {self.total/1024**2:.1f}MB on disk.")
@@ -0,0 +1,122 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/7/20} ${10:05}
+# @Function: sliding-window tile grid and batched tile scheduler for large image prediction
+
+
+import numpy as np
+import torch
+
+
+# Start/end of every window along one axis. The last windows are shifted back to stay inside the image,
+# so several loop positions can land on the same window; they are merged and counted in `repeat`.
+def axis_spans(length, tile_size=256, overlap=64):
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError(f"overlap({overlap}) must be smaller than tile_size({tile_size}).")
+
+    spans = {}
+    for i in range(0, length, stride):
+        end   = min(i   + tile_size, length)
+        start = max(end - tile_size, 0)
+        spans[(start, end)] = spans.get((start, end), 0) + 1
+    return [(start, end, repeat) for (start, end), repeat in spans.items()]
+
+
+# Tile grid of a [H, W] image as (x_start, x_end, y_start, y_end, repeat)
+def tile_grid(height, width, tile_size=256, overlap=64):
+    grid = []
+    for x_start, x_end, x_rep in axis_spans(height, tile_size, overlap):
+        for y_start, y_end, y_rep in axis_spans(width, tile_size, overlap):
+            grid.append((x_start, x_end, y_start, y_end, x_rep * y_rep))
+    return grid
+
+
+# Add batch predictions into the stitching accumulator, slots are (((x_start, x_end, y_start, y_end, repeat), h, w), ...)
+def accumulate(outputs, weights, predictions, slots):
+    for prediction, ((x_start, x_end, y_start, y_end, repeat), th, tw) in zip(predictions, slots):
+        prediction = prediction[:th, :tw]
+        outputs[x_start:x_end, y_start:y_end] += prediction * repeat if repeat > 1 else prediction
+        weights[x_start:x_end, y_start:y_end] += repeat
+
+
+class TileBatcher:
+    """
+    Pack tiles into batches through reusable staging buffers, one buffer per tile shape bucket and dtype.
+    Tiles keep their source dtype (e.g. uint16), the model converts them once they are on its device.
+    """
+
+    def __init__(self, bands, tile_size=256, batch_size=8, bucket=32, pin_memory=False):
+        self.bands      = bands
+        self.tile_size  = tile_size
+        self.batch_size = batch_size
+        self.bucket     = bucket
+        self.pin_memory = pin_memory
+        self.buffers    = {}
+
+    # Partial edge tiles are padded up to the next multiple of `bucket` (never beyond tile_size)
+    def bucket_shape(self, h, w):
+        bh = min(-(-h // self.bucket) * self.bucket, max(self.tile_size, h))
+        bw = min(-(-w // self.bucket) * self.bucket, max(self.tile_size, w))
+        return bh, bw
+
+    # Staging tensor and the numpy view sharing its memory
+    def buffer(self, shape, dtype=np.float32):
+        key = (shape, np.dtype(dtype))
+        if key not in self.buffers:
+            tensor = torch.from_numpy(np.zeros((self.batch_size, self.bands) + shape, dtype=dtype))
+            tensor = tensor.pin_memory() if self.pin_memory else tensor
+            self.buffers[key] = (tensor, tensor.numpy())
+        return self.buffers[key]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for _, array in self.buffers.values())
+
+    def batches(self, tiles):
+        """
+        tiles : iterable of (patch[C, h, w], meta)
+        yield : (tensor[N, C, bh, bw], [(meta, h, w), ...])
+        The yielded tensor is a view into a staging buffer, it is only valid until the next batch is requested.
+        """
+        pending = {}
+        for patch, meta in tiles:
+            _, h, w        = patch.shape
+            shape          = self.bucket_shape(h, w)
+            key            = (shape, patch.dtype)
+            tensor, array  = self.buffer(shape, patch.dtype)
+            slots          = pending.setdefault(key, [])
+            n              = len(slots)
+
+            array[n, :, :h, :w] = patch
+            if h < shape[0]:
+                array[n, :, h:, :] = 0
+            if w < shape[1]:
+                array[n, :, :h, w:] = 0
+            slots.append((meta, h, w))
+
+            if len(slots) == self.batch_size:
+                yield tensor, slots
+                pending[key] = []
+
+        for key, slots in pending.items():
+            if slots:
+                yield self.buffers[key][0][:len(slots)], slots
+
+
+# True if a tile carries no information: every value is NaN / nodata, or the whole tile is one constant (fill) value
+def empty_tile(patch, nodata=None):
+    if patch.dtype.kind == 'f':
+        valid = ~np.isnan(patch)
+        if nodata is not None:
+            valid &= patch != nodata
+    elif nodata is not None:
+        valid = patch != nodata
+    else:
+        return patch.min() == patch.max()
+
+    if not valid.any():
+        return True
+    values = patch[valid]
+    return values.min() == values.max()
@@ -0,0 +1,133 @@
+# encoding = utf-8
+
+# @Author  ：Lecheng Wang
+# @Time    : ${2025/8/07} ${09:45}
+# @Function: parallel block-wise polygonization of class rasters, polygons crossing block seams are merged, features are streamed to the shapefile
+
+
+import collections
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+CLASS_LABELS = {
+    1: "clean_glacier",
+    2: "debris_glacier"
+}
+
+
+def _affine_params(transform):
+    # rasterio Affine (a, b, c, d, e, f) -> shapely [a, b, d, e, xoff, yoff]
+    return [transform.a, transform.b, transform.d, transform.e, transform.c, transform.f]
+
+
+def _polygonize_block(source, row_start, row_end, height, ignore_values, affine):
+    """
+    Polygonize rows [row_start, row_end) of the class raster in one worker. `source` is the tif path (the block is read
+    with a window) or the block itself. Polygons are traced in pixel coordinates, those touching an inner block seam are
+    returned in pixel coordinates as WKB for merging, all the others are final and returned in map coordinates.
+    """
+
+    import rasterio
+    from rasterio.features  import shapes
+    from rasterio.transform import Affine
+    from rasterio.windows   import Window
+    from shapely.geometry   import shape
+    from shapely.affinity   import affine_transform
+
+    if isinstance(source, str):
+        with rasterio.open(source) as src:
+            block = src.read(1, window=Window(0, row_start, src.width, row_end - row_start))
+    else:
+        block = source
+    block = block.astype(np.uint8, copy=False)
+    mask  = ~np.isin(block, ignore_values)
+
+    interior, seam = [], []
+    for geom, value in shapes(block, mask=mask, transform=Affine.translation(0, row_start)):
+        polygon            = shape(geom)
+        _, min_y, _, max_y = polygon.bounds
+        if (row_start > 0 and min_y == row_start) or (row_end < height and max_y == row_end):
+            seam.append((int(value), polygon.wkb))
+        else:
+            interior.append((int(value), affine_transform(polygon, affine).wkb))
+    return interior, seam
+
+
+class ShapefileWriter:
+    """
+    Feature-by-feature ESRI Shapefile output with fiona (the writer behind the former geopandas export), reprojected
+    to `epsg_code` when it is set. The file is created with the first feature, an empty output writes nothing.
+    """
+
+    def __init__(self, shp_path, crs_wkt=None, epsg_code=None):
+        self.shp_path = shp_path
+        self.src_crs  = crs_wkt
+        self.crs      = f"EPSG:{str(epsg_code).replace('EPSG:', '')}" if epsg_code and crs_wkt else crs_wkt
+        self.schema   = {'geometry': 'Polygon', 'properties': {'class_id': 'int', 'label': 'str'}}
+        self.output   = None
+        self.count    = 0
+
+    def write(self, class_id, wkb):
+        import fiona
+        from fiona.transform  import transform_geom
+        from shapely          import wkb as shapely_wkb
+        from shapely.geometry import mapping
+
+        if self.output is None:
+            crs         = fiona.crs.CRS.from_user_input(self.crs) if self.crs else None
+            self.output = fiona.open(self.shp_path, 'w', driver='ESRI Shapefile', crs=crs, schema=self.schema)
+        geometry = mapping(shapely_wkb.loads(wkb))
+        if self.crs != self.src_crs:
+            geometry = transform_geom(self.src_crs, self.crs, geometry)
+        self.output.write({'geometry': geometry,
+                           'properties': {'class_id': class_id, 'label': CLASS_LABELS.get(class_id, "unknown")}})
+        self.count += 1
+
+    # Returns the number of written features
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+        return self.count
+
+
+def polygonize(source, height, transform, crs_wkt, shp_path, ignore_values, epsg_code=None, workers=None, block_rows=1024):
+    """
+    source : tif path (blocks are read by the workers) or [H, W] class array
+    Horizontal blocks of `block_rows` rows are polygonized in `workers` processes (4-connected, as rasterio shapes).
+    Interior polygons are written as soon as their block is done, only seam polygons are kept and merged per class.
+    return : number of features written
+    """
+
+    from shapely          import wkb as shapely_wkb
+    from shapely.ops      import unary_union
+    from shapely.affinity import affine_transform
+
+    affine = _affine_params(transform)
+    blocks = [(r, min(r + block_rows, height)) for r in range(0, height, block_rows)]
+    writer = ShapefileWriter(shp_path, crs_wkt, epsg_code)
+    seams  = collections.defaultdict(list)
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_polygonize_block, source if isinstance(source, str) else source[r0:r1], r0, r1, height, ignore_values, affine)
+                   for r0, r1 in blocks]
+        for future in as_completed(futures):
+            interior, seam = future.result()
+            for class_id, geometry in interior:
+                writer.write(class_id, geometry)
+            for class_id, geometry in seam:
+                seams[class_id].append(shapely_wkb.loads(geometry))
+
+    # Pixel coordinates are exact, pieces sharing a seam edge are dissolved, corner contacts stay separate polygons
+    merged = 0
+    for class_id, pieces in seams.items():
+        union = unary_union(pieces)
+        for polygon in getattr(union, 'geoms', [union]):
+            writer.write(class_id, affine_transform(polygon, affine).wkb)
+            merged += 1
+
+    count = writer.close()
+    print(f"Polygonized {len(blocks)} blocks, {sum(len(p) for p in seams.values())} seam pieces merged into {merged} polygons.")
+    return count